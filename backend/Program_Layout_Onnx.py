@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import time
+from models.Layout_Model import PREDICT_OPTIONS
+from models.Layout_Onnx_Model import OnnxLayoutModel, export_to_onnx, quantize_to_int8
+from services.frame_store import get_frame_pack, FRAME_PACK_NAME
+
+
+#### Program ####
+# ONNX Runtime path of the layout model: export, int8 quantization and a comparison against the Paddle
+# path on the same frames. Run from the backend directory:
+#
+#   python Program_Layout_Onnx.py export ~/.paddlex/official_models/PP-DocLayout_plus-L --output models/onnx/layout.onnx
+#   python Program_Layout_Onnx.py quantize models/onnx/layout.onnx --output models/onnx/layout.int8.onnx --calibrate 03_05_csp_local_search
+#   python Program_Layout_Onnx.py benchmark 03_05_csp_local_search --onnx models/onnx/layout.onnx models/onnx/layout.int8.onnx --threads 1 4
+#
+# Preprocessing uses the ONNX path with LAYOUT_BACKEND=onnx and LAYOUT_ONNX_MODEL=<path>.
+
+data_output_dir = "data"
+all_frames_output_dir = os.path.join(data_output_dir, "frames")
+
+
+def load_frames(video_name, limit=None):
+    """
+    BGR arrays of the extracted frames of a video, from its frame pack or the loose PNGs.
+    """
+    import numpy as np
+    from PIL import Image
+
+    frames_dir = os.path.join(all_frames_output_dir, video_name)
+    pack = get_frame_pack(os.path.join(frames_dir, FRAME_PACK_NAME))
+    if pack is not None:
+        images = [pack.open_image(frame_index) for frame_index in sorted(pack.frames)]
+    else:
+        image_dir = os.path.join(frames_dir, "images")
+        images = [Image.open(os.path.join(image_dir, name)) for name in sorted(os.listdir(image_dir))]
+
+    frames = [np.ascontiguousarray(np.array(image.convert("RGB"))[:, :, ::-1]) for image in images[:limit]]
+    return frames
+
+
+def create_paddle_model(threads):
+    from paddlex import create_model
+    from paddlex.inference import PaddlePredictorOption
+
+    option = PaddlePredictorOption()
+    option.device_type = "cpu"
+    option.cpu_threads = threads
+    return create_model(model_name="PP-DocLayout_plus-L", pp_option=option)
+
+
+def run_model(model, frames, batch_size):
+    """
+    Returns (raw boxes per frame, seconds per frame). The first batch is a warm-up and not timed.
+    """
+    list(model.predict(frames[:batch_size], batch_size=batch_size, **PREDICT_OPTIONS))
+
+    start = time.perf_counter()
+    results = list(model.predict(frames, batch_size=batch_size, **PREDICT_OPTIONS))
+    seconds = time.perf_counter() - start
+    return [result["boxes"] for result in results], seconds / len(frames)
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def compare(reference_boxes, candidate_boxes, iou_threshold=0.5):
+    """
+    Greedy one-to-one matching of boxes with the same label per frame. Returns precision, recall
+    and mean IoU of the matches, with the Paddle boxes as reference.
+    """
+    matched, ious, reference_count, candidate_count = 0, [], 0, 0
+    for reference, candidate in zip(reference_boxes, candidate_boxes):
+        reference_count += len(reference)
+        candidate_count += len(candidate)
+        pairs = sorted(
+            ((iou(r["coordinate"], c["coordinate"]), i, j)
+             for i, r in enumerate(reference) for j, c in enumerate(candidate) if r["label"] == c["label"]),
+            reverse=True,
+        )
+        used_reference, used_candidate = set(), set()
+        for value, i, j in pairs:
+            if value < iou_threshold:
+                break
+            if i in used_reference or j in used_candidate:
+                continue
+            used_reference.add(i)
+            used_candidate.add(j)
+            matched += 1
+            ious.append(value)
+
+    precision = matched / candidate_count if candidate_count else 1.0
+    recall = matched / reference_count if reference_count else 1.0
+    return precision, recall, sum(ious) / len(ious) if ious else None
+
+
+def benchmark(frames, onnx_paths, thread_counts, batch_size, skip_paddle=False):
+    rows = []
+    reference = {}
+    for threads in thread_counts:
+        if not skip_paddle:
+            start = time.perf_counter()
+            paddle_model = create_paddle_model(threads)
+            load_seconds = time.perf_counter() - start
+            boxes, seconds_per_frame = run_model(paddle_model, frames, batch_size)
+            reference[threads] = boxes
+            rows.append(dict(backend="paddle", model="PP-DocLayout_plus-L", threads=threads, load_s=load_seconds,
+                             ms_per_frame=seconds_per_frame * 1000, precision=1.0, recall=1.0, mean_iou=1.0))
+
+        for onnx_path in onnx_paths:
+            start = time.perf_counter()
+            onnx_model = OnnxLayoutModel(onnx_path, intra_op_threads=threads)
+            load_seconds = time.perf_counter() - start
+            boxes, seconds_per_frame = run_model(onnx_model, frames, batch_size)
+            precision, recall, mean_iou = compare(reference[threads], boxes) if threads in reference else (None, None, None)
+            rows.append(dict(backend="onnx", model=os.path.basename(onnx_path), threads=threads, load_s=load_seconds,
+                             ms_per_frame=seconds_per_frame * 1000, precision=precision, recall=recall, mean_iou=mean_iou))
+
+    # speed-up against the Paddle path with the same thread count
+    paddle_ms = {row["threads"]: row["ms_per_frame"] for row in rows if row["backend"] == "paddle"}
+    for row in rows:
+        row["frames_per_s_per_core"] = 1000 / row["ms_per_frame"] / row["threads"]
+        row["speedup"] = paddle_ms[row["threads"]] / row["ms_per_frame"] if row["threads"] in paddle_ms else None
+    return rows
+
+
+def format_report(rows, frame_count, batch_size):
+    def fmt(value, digits=3):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    lines = [
+        f"Layout detection, {frame_count} frames, batch size {batch_size}",
+        "",
+        "| backend | model | threads | load s | ms/frame | frames/s/core | speed-up | precision | recall | mean IoU |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for row in rows:
+        lines.append(
+            f"| {row['backend']} | {row['model']} | {row['threads']} | {fmt(row['load_s'], 1)} | {fmt(row['ms_per_frame'], 1)} "
+            f"| {fmt(row['frames_per_s_per_core'], 2)} | {fmt(row['speedup'], 2)} | {fmt(row['precision'])} | {fmt(row['recall'])} | {fmt(row['mean_iou'])} |"
+        )
+    lines.append("")
+    lines.append("precision/recall: boxes with the same label and IoU >= 0.5 as the Paddle boxes (before grouping)")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ONNX Runtime / int8 path of the layout model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="convert the paddle inference model with paddle2onnx")
+    export_parser.add_argument("paddle_model_dir")
+    export_parser.add_argument("--output", default=os.path.join("models", "onnx", "layout.onnx"))
+
+    quantize_parser = commands.add_parser("quantize", help="int8 quantization of an exported model")
+    quantize_parser.add_argument("onnx_model")
+    quantize_parser.add_argument("--output", default=os.path.join("models", "onnx", "layout.int8.onnx"))
+    quantize_parser.add_argument("--calibrate", nargs="*", default=[], metavar="VIDEO",
+                                 help="videos whose frames calibrate static quantization (default: dynamic)")
+    quantize_parser.add_argument("--calibration-frames", type=int, default=64)
+
+    benchmark_parser = commands.add_parser("benchmark", help="accuracy/throughput against the Paddle path")
+    benchmark_parser.add_argument("videos", nargs="+")
+    benchmark_parser.add_argument("--onnx", nargs="+", default=[], help="exported .onnx models to compare")
+    benchmark_parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    benchmark_parser.add_argument("--batch-size", type=int, default=1)
+    benchmark_parser.add_argument("--limit", type=int, default=None, help="frames per video")
+    benchmark_parser.add_argument("--skip-paddle", action="store_true", help="only time the ONNX models")
+    benchmark_parser.add_argument("--report", help="also write the report (markdown) and the raw rows (.json) here")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(export_to_onnx(args.paddle_model_dir, args.output))
+
+    elif args.command == "quantize":
+        calibration_frames = []
+        for video_name in args.calibrate:
+            calibration_frames += load_frames(video_name)
+        calibration_frames = calibration_frames[:args.calibration_frames]
+        print(quantize_to_int8(args.onnx_model, args.output, calibration_images=calibration_frames or None))
+
+    elif args.command == "benchmark":
+        frames = []
+        for video_name in args.videos:
+            frames += load_frames(video_name, limit=args.limit)
+
+        rows = benchmark(frames, args.onnx, args.threads, args.batch_size, skip_paddle=args.skip_paddle)
+        report = format_report(rows, len(frames), args.batch_size)
+        print(report)
+
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+            with open(os.path.splitext(args.report)[0] + ".json", "w", encoding="utf-8") as f:
+                json.dump(rows, f, indent=2)
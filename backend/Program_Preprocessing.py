@@ -6,15 +6,27 @@ from models.Transcription_Model import WhisperTranscriber
 from models.Transcript_Chunker import TranscriptChunker
 from models.GPT_Model import GPTModel
 from models.Video_Manager import VideoManager
+from models.Video_Transcoder import HLSTranscoder
+from models.Thumbnail_Sprite_Builder import ThumbnailSpriteBuilder
+from services.video_index import publish_video_index
+from services.frame_store import migrate_video
+from services.storage import get_storage
+from services.explanation_cache import compact_explanations
+from services.ingest import IngestStatus
+from services.http_cache import SHORT_MAX_AGE
 import os
+import sys
 import shutil
+import time
 import random
 
 
 #### Program #### 
 
+# usage (from the backend directory): python Program_Preprocessing.py [<video path>]
+# uploads via POST /videos are preprocessed the same way by the ingest workers (services/ingest.py)
 script_dir = os.path.dirname(os.path.abspath(__file__))
-video_path = os.path.join(script_dir, "03_05_csp_local_search.mp4")
+video_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(script_dir, "03_05_csp_local_search.mp4")
 
 # create directories for data
 data_output_dir = "data"
@@ -22,6 +34,8 @@ all_videos_output_dir = os.path.join(data_output_dir, "lecture_videos")
 all_frames_output_dir = os.path.join(data_output_dir, "frames")             # stores all extracted jpg frames from the videos
 all_layouts_output_dir = os.path.join(data_output_dir, "layouts")           # stores all layout data of the extracted frames (output of laytout detection model)
 all_transcripts_output_dir = os.path.join(data_output_dir, "transcripts")       # stores the complete transcripts of the lecture videos with additional segment information
+all_hls_output_dir = os.path.join(data_output_dir, "hls")                   # stores the adaptive-bitrate HLS renditions of the lecture videos
+all_thumbnails_output_dir = os.path.join(data_output_dir, "thumbnails")     # stores the timeline sprite sheets + WebVTT thumbnail tracks
 
 lecture_video_name = os.path.splitext(os.path.basename(video_path))[0]      # lecture video name without 'mp4'
 
@@ -29,6 +43,8 @@ videos_output_dir = os.path.join(all_videos_output_dir, lecture_video_name)
 frames_output_dir = os.path.join(all_frames_output_dir, lecture_video_name)
 layouts_output_dir = os.path.join(all_layouts_output_dir, lecture_video_name)
 transcripts_output_dir = os.path.join(all_transcripts_output_dir, lecture_video_name)
+hls_output_dir = os.path.join(all_hls_output_dir, lecture_video_name)
+thumbnails_output_dir = os.path.join(all_thumbnails_output_dir, lecture_video_name)
 
 # Now create the folders or check if existing already
 os.makedirs(videos_output_dir, exist_ok=True)
@@ -36,37 +52,121 @@ os.makedirs(transcripts_output_dir, exist_ok=True)
 os.makedirs(frames_output_dir, exist_ok=True)
 os.makedirs(layouts_output_dir, exist_ok=True)
 
-VideoManager.copy_video_to_data_dir(
-    source_path=video_path, 
-    video_name=lecture_video_name, 
-    dest_dir=videos_output_dir
-    )
+# every stage reports its progress (GET /videos/<name>/status) and hands its results to the storage the
+# API nodes read from (STORAGE_BACKEND) right away, so e.g. the video and its transcript are served
+# while the layouts are still running
+storage = get_storage()
+status = IngestStatus(data_output_dir, lecture_video_name, storage)
 
-VideoManager.store_metadata(
-    video_path=video_path, 
-    dest_dir=videos_output_dir
-    )
+def publish(*output_dirs):
+    for output_dir in output_dirs:
+        storage.sync_tree(output_dir, os.path.relpath(output_dir, data_output_dir).replace(os.sep, "/"))
 
 
-# copy_video_to_data_dir(src_video_path=video_path, video_name=lecture_video_name, dest_dir=videos_output_dir)
-
-# extract the time stamps (frame indices) at which the slides are changing
-timeExtractor = TimeStampExtractor(video_path, sample_rate = 0.2)
-slideChanges = timeExtractor.extract_timestamps_and_store(frames_output_dir)
+with status.stage("video"):
+    VideoManager.copy_video_to_data_dir(
+        source_path=video_path, 
+        video_name=lecture_video_name, 
+        dest_dir=videos_output_dir
+        )
 
-# extract the frames at the previoiusly defined indices
-frameExtractor = FrameExtractor(video_path, output_dir=frames_output_dir)
-frameExtractor.get_frames_and_store(slideChanges)             # frame indices implicitly casted to miliseconds
+    metadata = VideoManager.store_metadata(
+        video_path=video_path, 
+        dest_dir=videos_output_dir
+        )
+    publish(videos_output_dir)
 
-# extract the complete transcript in the preprocessing step
-transcriber = WhisperTranscriber(video_path, output_dir=transcripts_output_dir)
-full_transcript = transcriber.transcribe_and_store()
-
-# chunk the transcript for embedding purpose
-chunker = TranscriptChunker(output_dir=transcripts_output_dir)
-chunks = chunker.chunk_transcript_and_store(full_transcript["segments"], enrich_with_gpt=True)
 
+# copy_video_to_data_dir(src_video_path=video_path, video_name=lecture_video_name, dest_dir=videos_output_dir)
 
-# run layout detection model and store png + json results
-layoutDetector = LayoutModel(input_dir=frameExtractor.img_output_dir, output_dir=layouts_output_dir)
-layoutDetector.run_and_store_all_frames()
\ No newline at end of file
+with status.stage("frames"):
+    # extract the time stamps (frame indices) at which the slides are changing
+    timeExtractor = TimeStampExtractor(video_path, sample_rate = 0.2)
+    slideChanges = timeExtractor.extract_timestamps_and_store(frames_output_dir)
+
+    # extract the frames at the previoiusly defined indices
+    frameExtractor = FrameExtractor(video_path, output_dir=frames_output_dir)
+    frameExtractor.get_frames_and_store(slideChanges)             # frame indices implicitly casted to miliseconds
+    publish(frames_output_dir)
+
+with status.stage("thumbnails"):
+    # pack thumbnails of the extracted frames into sprite sheets for the timeline preview
+    spriteBuilder = ThumbnailSpriteBuilder(
+        frames_dir=frames_output_dir,
+        metadata_path=os.path.join(videos_output_dir, "metadata.json"),
+        output_dir=thumbnails_output_dir,
+        video_path=video_path
+        )
+    spriteBuilder.build_and_store()
+    publish(thumbnails_output_dir)
+
+with status.stage("transcript"):
+    # extract the complete transcript in the preprocessing step
+    transcriber = WhisperTranscriber(video_path, output_dir=transcripts_output_dir)
+    full_transcript = transcriber.transcribe_and_store()
+
+    # chunk the transcript for embedding purpose
+    chunker = TranscriptChunker(output_dir=transcripts_output_dir)
+    chunks = chunker.chunk_transcript_and_store(full_transcript["segments"], enrich_with_gpt=True)
+    publish(transcripts_output_dir)
+
+
+with status.stage("layouts"):
+    # run layout detection model and store png + json results (incl. OCR text per box)
+    # LAYOUT_BACKEND=onnx runs the exported (int8) model with ONNX Runtime instead of paddle, see Program_Layout_Onnx.py
+    layoutDetector = LayoutModel(
+        input_dir=frameExtractor.img_output_dir,
+        output_dir=layouts_output_dir,
+        with_ocr=True,
+        backend=os.getenv("LAYOUT_BACKEND", "paddle"),
+        onnx_model_path=os.getenv("LAYOUT_ONNX_MODEL"),
+        intra_op_threads=int(os.getenv("LAYOUT_ONNX_THREADS", 0)) or None,
+        batch_size=int(os.getenv("LAYOUT_BATCH_SIZE", 1))
+        )
+    layoutDetector.run_and_store_all_frames(
+        progress_callback=lambda done, total: status.progress("layouts", done, total)
+        )
+    publish(layouts_output_dir)
+
+with status.stage("hls"):
+    # transcode the lecture into a small ladder of HLS renditions (served by /hls/<video>/master.m3u8);
+    # the mp4 is already served meanwhile
+    transcoder = HLSTranscoder(video_path, output_dir=hls_output_dir)
+    transcoder.transcode_and_store(source_width=metadata["width"], source_height=metadata["height"])
+    publish(hls_output_dir)
+    hls_published_at = time.monotonic()
+
+
+with status.stage("pack"):
+    # pack frames and layout visualizations into one file per video; the loose PNGs are only
+    # needed as input of the steps above
+    migrate_video(data_output_dir, lecture_video_name, remove_loose=True)
+    publish(frames_output_dir, layouts_output_dir)
+
+
+with status.stage("index"):
+    # publish the read-only arrays (embeddings, chunk times, boxes) that the API workers memory-map;
+    # running workers pick up the new generation on their next request. The index goes last, so
+    # nodes only switch to the new generation once everything it refers to is uploaded
+    publish_video_index(data_output_dir, lecture_video_name)
+    publish(os.path.join(data_output_dir, "index", lecture_video_name))
+
+
+# sprite sheets and segments of an earlier build of this lecture go once the thumbnail track and the
+# playlists referencing them (served with max-age SHORT_MAX_AGE) have expired everywhere; the HLS stage
+# published last, and usually the stages after it took longer than that. A first build has nothing to
+# remove and does not wait (the ingest worker runs one preprocessing at a time)
+if spriteBuilder.earlier_build_files() or transcoder.earlier_build_files():
+    time.sleep(max(0.0, SHORT_MAX_AGE + 10 - (time.monotonic() - hls_published_at)))
+    if spriteBuilder.remove_earlier_builds():
+        publish(thumbnails_output_dir)
+    if transcoder.remove_earlier_builds():
+        publish(hls_output_dir)
+
+
+# merge the explanation fingerprints written by the API workers (see services/explanation_cache.py);
+# best effort, the lecture is already published
+try:
+    print(f"Compacted the explanation store: {compact_explanations(get_storage())}")
+except Exception as e:
+    print(f"Could not compact the explanation store: {e}")
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+from models.Transcript_Chunker import TranscriptChunker, SEGMENT_EMBEDDINGS_FILE
+from services.video_index import publish_video_index
+from services.storage import get_storage
+
+
+#### Program ####
+# Re-chunks the transcripts of the whole catalogue offline from the stored segment embeddings,
+# without any API call. Run from the backend directory:
+#
+#   python Program_Rechunk.py --thresholds 0.2 0.26 0.3 0.35        sweep thresholds, print chunk statistics
+#   python Program_Rechunk.py --method texttiling --window 3        try TextTiling-style segmentation
+#   python Program_Rechunk.py --thresholds 0.3 --write              write chunks.json (+ video index) for one setting
+
+data_output_dir = "data"
+all_transcripts_output_dir = os.path.join(data_output_dir, "transcripts")
+
+
+def rechunk(segments, embeddings, method, threshold=None, window=3):
+    TranscriptChunker.check_segment_embeddings(segments, embeddings)
+    if method == "texttiling":
+        boundaries = TranscriptChunker.find_texttiling_boundaries(embeddings, window=window)
+    else:
+        boundaries = TranscriptChunker.find_boundaries(embeddings, threshold)
+    return TranscriptChunker.build_chunks(segments, boundaries)
+
+
+def carry_over_enrichment(new_chunks, old_chunks, embeddings):
+    """
+    Offline replacement for the per-chunk API calls: the chunk embedding becomes the normalized mean
+    of its segment embeddings, label and summary are taken from the old chunk overlapping it most.
+    """
+    for chunk in new_chunks:
+        start, end = chunk["segment_range"]
+        mean_embedding = TranscriptChunker.normalize(embeddings[start:end].mean(axis=0, keepdims=True))[0]
+        chunk["embedding"] = mean_embedding.tolist()
+
+        overlaps = [
+            (min(chunk["end"], old["end"]) - max(chunk["start"], old["start"]), old)
+            for old in old_chunks
+        ]
+        overlap, best_old = max(overlaps, key=lambda item: item[0], default=(0, None))
+        if best_old is not None and overlap > 0:
+            for key in ("label", "summary"):
+                if key in best_old:
+                    chunk[key] = best_old[key]
+
+
+def stats(chunks):
+    durations = [chunk["end"] - chunk["start"] for chunk in chunks]
+    if not durations:
+        return 0, 0.0, 0.0      # e.g. a video without transcript segments
+    return len(chunks), sum(durations) / len(durations), max(durations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-chunk transcripts offline from stored segment embeddings.")
+    parser.add_argument("videos", nargs="*", help="video names (default: every video with stored segment embeddings)")
+    parser.add_argument("--method", choices=["threshold", "texttiling"], default="threshold")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.2, 0.26, 0.3, 0.35, 0.4])
+    parser.add_argument("--window", type=int, default=3, help="segments per block for texttiling")
+    parser.add_argument("--write", action="store_true", help="store the result as chunks.json (single threshold only)")
+    args = parser.parse_args()
+
+    if args.write and args.method == "threshold" and len(args.thresholds) != 1:
+        parser.error("--write needs exactly one threshold")
+
+    video_names = args.videos or sorted(
+        name for name in os.listdir(all_transcripts_output_dir)
+        if os.path.isfile(os.path.join(all_transcripts_output_dir, name, SEGMENT_EMBEDDINGS_FILE))
+    )
+    settings = args.thresholds if args.method == "threshold" else [None]
+
+    print(f"{'video':40} {'setting':>12} {'chunks':>7} {'mean s':>8} {'max s':>8}")
+    for video_name in video_names:
+        transcripts_output_dir = os.path.join(all_transcripts_output_dir, video_name)
+        with open(os.path.join(transcripts_output_dir, "full_transcript.json"), "r", encoding="utf-8") as f:
+            segments = json.load(f)["segments"]
+        embeddings = TranscriptChunker.load_segment_embeddings(transcripts_output_dir)
+        try:
+            TranscriptChunker.check_segment_embeddings(segments, embeddings)
+        except ValueError as e:
+            # e.g. the transcript was redone after the embeddings were stored
+            print(f"{video_name:40} skipped: {e}")
+            continue
+
+        for threshold in settings:
+            chunks = rechunk(segments, embeddings, args.method, threshold=threshold, window=args.window)
+            setting = f"t={threshold}" if threshold is not None else f"tt w={args.window}"
+            count, mean_duration, max_duration = stats(chunks)
+            print(f"{video_name:40} {setting:>12} {count:>7} {mean_duration:>8.1f} {max_duration:>8.1f}")
+
+            if args.write:
+                with open(os.path.join(transcripts_output_dir, "chunks.json"), "r", encoding="utf-8") as f:
+                    old_chunks = json.load(f)
+                carry_over_enrichment(chunks, old_chunks, embeddings)
+
+                chunker = TranscriptChunker(similarity_threshold=threshold, output_dir=transcripts_output_dir)
+                chunker.store_chunks(chunks)
+                publish_video_index(data_output_dir, video_name)
+
+                storage = get_storage()
+                storage.sync_tree(transcripts_output_dir, f"transcripts/{video_name}")
+                storage.sync_tree(os.path.join(data_output_dir, "index", video_name), f"index/{video_name}")
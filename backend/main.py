@@ -1,23 +1,45 @@
+import hashlib
 import io
 import math
-from typing import List
-import numpy as np
+import mimetypes
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from pydantic import BaseModel
-from PIL import Image
-from fastapi import FastAPI, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Form, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
 import os
 import json
+import uuid
 
 
-from .services.transcript import get_transcript_chunks_for_pause
+from .services.transcript import get_transcript_chunks_for_pause, build_transcript_context, warm_up_tokenizer
 from .services.image_transform import pil_image_to_bytes
-from .services.gpt import get_gpt_explanation, get_gpt_embedding, cosine_sim
-from .services.coordinates import get_box_coordinates
-
-app = FastAPI()
+from .services.gpt import get_gpt_explanation_async, get_gpt_text_explanation_async, get_gpt_adapted_explanation_async, get_gpt_embedding_async, get_embedding_batcher, get_upstream_scheduler, cosine_sim, warm_up_gpt
+from .services.upstream_scheduler import RequestCancelled
+from .services.coordinates import get_boxes
+from .services.video_index import get_video_index
+from .services.frame_store import get_frame_pack, FRAME_PACK_NAME
+from .services.http_cache import storage_file_response, ranged_storage_response, IMMUTABLE_MAX_AGE, SHORT_MAX_AGE
+from .services.storage import get_storage, normalize_key, CachedStorage
+from .services.ingest import get_ingest_queue, read_status, is_valid_video_name, UPLOAD_DIR
+from .services.explanation_cache import get_explanation_index, Fingerprint, difference_hash, normalize_text, EXPLANATION_REUSE_ENABLED
+from .services.warmup import start_warmup, is_ready, warmup_status
+
+
+# numpy, PIL, the tokenizer and the OpenAI client are loaded in a background thread after startup,
+# so a fresh worker answers /health immediately and reports /ready once warmed up
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_warmup([warm_up_gpt, warm_up_tokenizer])
+    # uploads whose preprocessing was interrupted by a restart
+    get_ingest_queue().resume_pending(get_storage())
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",  # frontend URL and port
@@ -37,52 +59,355 @@ app.add_middleware(
 
 # Use absolute paths relative to this file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-
-FRAME_DIR = os.path.join(DATA_DIR, "frames")
-LAYOUT_DIR = os.path.join(DATA_DIR, "layouts")
-VIDEO_DIR = os.path.join(DATA_DIR, "lecture_videos")
-TRANSCRIPT_DIR = os.path.join(DATA_DIR, "transcripts")
-
-# Serve the entire 'data' folder at /data URL prefix
-
-app.mount("/data", StaticFiles(directory=DATA_DIR), name="data")
-
 
+# all data is read through the storage backend (local folder or object storage with a local cache,
+# see services/storage.py); these are the key prefixes of the data folders
+FRAME_DIR = "frames"
+LAYOUT_DIR = "layouts"
+VIDEO_DIR = "lecture_videos"
+TRANSCRIPT_DIR = "transcripts"
+HLS_DIR = "hls"
+THUMBNAIL_DIR = "thumbnails"
+
+# per-video folders that are downloaded in the background when a video is opened on a node
+# (videos and HLS segments are streamed instead)
+PREFETCH_DIRS = [FRAME_DIR, LAYOUT_DIR, TRANSCRIPT_DIR, "index", THUMBNAIL_DIR]
+
+
+def prefetch_video(video_name: str):
+    get_storage().prefetch([f"{folder}/{video_name}/" for folder in PREFETCH_DIRS])
+
+
+def read_json(key: str, detail: str):
+    try:
+        return get_storage().read_json(key)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail=detail)
+
+
+# folders of the storage that are not published: ingest status (errors), the explanation store, uploads
+# of older deployments and dot folders (e.g. a local cache)
+PRIVATE_DATA_PREFIXES = ("status/", "explanations/", "uploads/", ".")
+
+
+# Serve the 'data' folder at /data URL prefix
+@app.get("/data/{file_path:path}")
+def get_data_file(file_path: str):
+    try:
+        key = normalize_key(file_path)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if key.startswith(PRIVATE_DATA_PREFIXES) or "/." in key:
+        raise HTTPException(status_code=404, detail="File not found")
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    return storage_file_response(get_storage(), key, media_type, SHORT_MAX_AGE)
+
+
+# liveness: the process is up and serving requests
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+# readiness: heavy dependencies and the OpenAI client are loaded
+@app.get("/ready")
+def ready():
+    status = warmup_status()
+    if not is_ready():
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+# upstream embedding requests vs. /associate calls, to check how well the micro-batching works
+@app.get("/stats/embeddings")
+def embedding_stats():
+    return get_embedding_batcher().stats()
+
+# queue depth, wait times and cancellations of the OpenAI call scheduler
+@app.get("/stats/upstream")
+def upstream_stats():
+    return get_upstream_scheduler().stats()
+
+# hit rate and size of the local cache in front of object storage
+@app.get("/stats/storage")
+def storage_stats():
+    storage = get_storage()
+    if not isinstance(storage, CachedStorage):
+        return {"backend": type(storage).__name__}
+    return dict(storage.cache_stats(), backend=type(storage).__name__)
+
+
+# running and queued preprocessing jobs of uploaded videos
+@app.get("/stats/ingest")
+def ingest_stats():
+    return get_ingest_queue().stats()
+
+
+# reused vs. freshly generated explanations and lookup times of the fingerprint index
+@app.get("/stats/explanations")
+def explanation_stats():
+    if not EXPLANATION_REUSE_ENABLED:
+        return {"enabled": False}
+    return dict(get_explanation_index(get_storage()).stats(), enabled=True)
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 8 * 1024 ** 3))
+MAX_FORM_OVERHEAD_BYTES = 64 * 1024     # multipart boundaries, part headers and the small fields
+MAX_FORM_FIELD_BYTES = 1024
+
+
+# new lecture: multipart form (field "file", optional field "name") or the raw video as request body
+# (?name=<video name>). The upload is written to disk chunk by chunk as it arrives and preprocessed in
+# the background; progress at /videos/{video_name}/status
+@app.post("/videos", status_code=202)
+async def upload_video(request: Request, name: Optional[str] = None):
+    is_form = request.headers.get("content-type", "").startswith("multipart/form-data")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + (MAX_FORM_OVERHEAD_BYTES if is_form else 0):
+        raise HTTPException(status_code=413, detail="Video too large")
+
+    storage = get_storage()
+    queue = get_ingest_queue()
+    if not is_form:
+        # claimed across all worker processes until its preprocessing ends (or the upload fails)
+        video_name, ext = parse_video_name(name)
+        if not queue.claim(video_name):
+            raise HTTPException(status_code=409, detail="Video already exists")
+        try:
+            await check_new_video(storage, video_name)
+            video_path, size = await receive_upload(request.stream(), video_name, ext)
+        except BaseException:
+            queue.release(video_name)
+            raise
+    else:
+        # the name may follow the file in the form, so the video is claimed once the upload is in
+        form = MultipartFileStream(request)
+        part_path, size = await write_upload_part(form)
+        try:
+            video_name, ext = parse_video_name(name or form.fields.get("name") or os.path.basename((form.filename or "").replace("\\", "/")))
+            if not queue.claim(video_name):
+                raise HTTPException(status_code=409, detail="Video already exists")
+        except BaseException:
+            await run_in_threadpool(os.remove, part_path)
+            raise
+        try:
+            await check_new_video(storage, video_name)
+            video_path = os.path.join(UPLOAD_DIR, video_name + ext)
+            await run_in_threadpool(os.replace, part_path, video_path)
+        except BaseException:
+            queue.release(video_name)
+            if os.path.exists(part_path):
+                await run_in_threadpool(os.remove, part_path)
+            raise
+
+    queue.submit(video_name, video_path, storage)
+    return {
+        "video_name": video_name,
+        "size": size,
+        "status": f"/videos/{video_name}/status",
+    }
+
+
+def parse_video_name(name: Optional[str]):
+    if not name:
+        raise HTTPException(status_code=400, detail="Video name is missing")
+    video_name, ext = os.path.splitext(name)
+    ext = ext.lower() or ".mp4"
+    if not is_valid_video_name(video_name) or ext not in (".mp4", ".mov", ".mkv", ".webm"):
+        raise HTTPException(status_code=400, detail="Invalid video name")
+    return video_name, ext
+
+
+async def check_new_video(storage, video_name: str):
+    status = await run_in_threadpool(read_status, storage, video_name)
+    metadata = await run_in_threadpool(storage.stat, f"{VIDEO_DIR}/{video_name}/metadata.json")
+    if (status is not None and status["state"] != "failed") or metadata is not None:
+        raise HTTPException(status_code=409, detail="Video already exists")
+
+
+class MultipartFileStream:
+    """
+    The data of the "file" part of a multipart/form-data request, parsed from the request stream as it
+    arrives (the form parser of Starlette spools the whole body to a temporary file first, before any size
+    limit applies). The other fields are collected in fields, the file name of the part in filename.
+    """
+
+    def __init__(self, request: Request):
+        _, options = parse_options_header(request.headers.get("content-type", ""))
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="Multipart boundary is missing")
+        self.request = request
+        self.fields = {}
+        self.filename: Optional[str] = None
+        self.has_file = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._part_name: Optional[str] = None
+        self._part_filename: Optional[str] = None
+        self._part_is_file = False
+        self._field_value = bytearray()
+        self._file_data: List[bytes] = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._part_name, self._part_filename, self._part_is_file = None, None, False
+        self._field_value = bytearray()
+
+    def _on_header_end(self):
+        if bytes(self._header_field).lower() == b"content-disposition":
+            _, options = parse_options_header(bytes(self._header_value))
+            self._part_name = options.get(b"name", b"").decode("utf-8", "replace")
+            filename = options.get(b"filename")
+            self._part_filename = filename.decode("utf-8", "replace") if filename is not None else None
+        self._header_field, self._header_value = bytearray(), bytearray()
+
+    def _on_headers_finished(self):
+        # only the first file part is the upload
+        self._part_is_file = self._part_name == "file" and self._part_filename is not None and not self.has_file
+        if self._part_is_file:
+            self.has_file = True
+            self.filename = self._part_filename
+
+    def _on_part_data(self, data, start, end):
+        if self._part_is_file:
+            self._file_data.append(bytes(data[start:end]))
+        elif len(self._field_value) + end - start > MAX_FORM_FIELD_BYTES:
+            raise HTTPException(status_code=413, detail="Form field too large")
+        else:
+            self._field_value.extend(data[start:end])
+
+    def _on_part_end(self):
+        if not self._part_is_file and self._part_name:
+            self.fields[self._part_name] = self._field_value.decode("utf-8", "replace")
+
+    async def __aiter__(self):
+        body_size = 0
+        async for chunk in self.request.stream():
+            body_size += len(chunk)
+            if body_size > MAX_UPLOAD_BYTES + MAX_FORM_OVERHEAD_BYTES:
+                raise HTTPException(status_code=413, detail="Video too large")
+            try:
+                self._parser.write(chunk)
+            except MultipartParseError:
+                raise HTTPException(status_code=400, detail="Invalid multipart body")
+            if self._file_data:
+                data = b"".join(self._file_data)
+                self._file_data.clear()
+                yield data
+        self._parser.finalize()
+        if not self.has_file:
+            raise HTTPException(status_code=400, detail="Form field 'file' is missing")
+
+
+async def write_upload_part(chunks):
+    """
+    Writes the upload to a new temporary file in UPLOAD_DIR; returns its path and size. File I/O runs in the
+    thread pool: an upload of several GB must not stall the other requests.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    part_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.part")
+    size = 0
+    f = await run_in_threadpool(open, part_path, "wb")
+    try:
+        buffer = bytearray()
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Video too large")
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(f.write, buffer)
+                buffer = bytearray()
+        await run_in_threadpool(f.write, buffer)
+        await run_in_threadpool(f.close)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty upload")
+    except BaseException:
+        if not f.closed:
+            await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, part_path)
+        raise
+    return part_path, size
+
+
+async def receive_upload(chunks, video_name: str, ext: str):
+    part_path, size = await write_upload_part(chunks)
+    video_path = os.path.join(UPLOAD_DIR, video_name + ext)
+    try:
+        await run_in_threadpool(os.replace, part_path, video_path)
+    except BaseException:
+        await run_in_threadpool(os.remove, part_path)
+        raise
+    return video_path, size
+
+
+# per-stage progress of the preprocessing; "available" lists what is already served
+# (e.g. video and transcript while the layouts are still running)
+@app.get("/videos/{video_name}/status")
+def get_video_status(video_name: str):
+    if not is_valid_video_name(video_name):
+        raise HTTPException(status_code=404, detail="Video not found")
+    status = read_status(get_storage(), video_name)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return status
 
 
 # "/video/{video_name}" is the endpoint that comes with a communication exchange when it's active
 # here: GET request: recieving information from that endpoint
 @app.get("/video/{video_name}")
-def get_video(video_name: str):
-    base_path = os.path.join(VIDEO_DIR, video_name)
-    file_path = os.path.join(base_path, video_name)
-    if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="Video not found")
+def get_video(video_name: str, request: Request):
+    storage = get_storage()
+    key = f"{VIDEO_DIR}/{video_name}/{video_name}"
     # whenever information is returned from an endpoint, Fast-API translates it into JSON format
     # whenever information is send to an endpoint, Fast-API translates JSON to vanilla python types
-    return FileResponse(file_path, media_type="video/mp4")
+    file_path = storage.cached_path(key)
+    if file_path is not None:
+        return FileResponse(file_path, media_type="video/mp4")      # answers Range requests itself
+
+    # not on this node yet: stream the requested byte range from object storage, cache it meanwhile
+    try:
+        response = ranged_storage_response(storage, key, "video/mp4", request.headers.get("range"))
+    except HTTPException:
+        raise HTTPException(status_code=404, detail="Video not found")
+    storage.cache_in_background(key)
+    return response
+
+# adaptive-bitrate renditions: /hls/{video_name}/master.m3u8 references the per-rendition
+# playlists, which reference the .ts segments
+@app.get("/hls/{video_name}/{file_path:path}")
+def get_hls_file(video_name: str, file_path: str):
+    key = f"{HLS_DIR}/{video_name}/{file_path}"
+    if key.endswith(".m3u8"):
+        return storage_file_response(get_storage(), key, "application/vnd.apple.mpegurl", SHORT_MAX_AGE)
+    if key.endswith(".ts"):
+        return storage_file_response(get_storage(), key, "video/mp2t", IMMUTABLE_MAX_AGE, immutable=True)
+    raise HTTPException(status_code=404, detail="File not found")
 
 # if the parameter in the function would not be given in the @app.get(parameter) line, then by 
 # default this parameter is a "query parameter"
 # query parameter in endpoint "?parameter=value" at the end of the path
 @app.get("/layout/{video_name}/{frame_index}")
 def get_layout_data(video_name: str, frame_index: str):
-    base_path = os.path.join(LAYOUT_DIR, video_name)
+    base_path = f"{LAYOUT_DIR}/{video_name}"
     # json_path = os.path.join(base_path, "res", f"{frame_index}_frame.json")
     # img_path = os.path.join(base_path, "images", f"{frame_index}_frame.png")
     
     json_file = f"{frame_index}_frame.json"
     # img_file = f"{frame_index}_frame.png"
 
-    json_path = os.path.join(base_path, "res", json_file)
+    json_key = f"{base_path}/res/{json_file}"
     # img_path = os.path.join(base_path, "images", img_file)
 
-    if not os.path.isfile(json_path):
-        raise HTTPException(status_code=404, detail="Layout data not found")
-
-    with open (json_path, "r") as f:
-        return json.load(f)
+    return read_json(json_key, "Layout data not found")
     
     # return {
     #     "json": f"/data/layouts/{video_name}/res/{json_file}",
@@ -91,77 +416,229 @@ def get_layout_data(video_name: str, frame_index: str):
 
 @app.get("/metadata/{video_name}")
 def get_metadata(video_name: str):
-    base_path = os.path.join(VIDEO_DIR, video_name)
-    file_path = os.path.join(base_path, "metadata.json")
-
-    if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="Metadata of video not found")
-    
-    with open(file_path, "r") as f:
-        return json.load(f)         # returns Python dict
+    # the player opens a video with its metadata: start pulling its assets onto this node
+    prefetch_video(video_name)
+    return read_json(f"{VIDEO_DIR}/{video_name}/metadata.json", "Metadata of video not found")    # returns Python dict
     
 
+# timeline previews: thumbnails.vtt maps time ranges to regions of the sprite-sheet images
+@app.get("/thumbnails/{video_name}/{file_name}")
+def get_thumbnail_file(video_name: str, file_name: str):
+    key = f"{THUMBNAIL_DIR}/{video_name}/{file_name}"
+    if key.endswith(".vtt"):
+        return storage_file_response(get_storage(), key, "text/vtt", SHORT_MAX_AGE)
+    if key.endswith(".jpg"):
+        return storage_file_response(get_storage(), key, "image/jpeg", IMMUTABLE_MAX_AGE, immutable=True)
+    raise HTTPException(status_code=404, detail="File not found")
+
+
 @app.get("/frame/{video_name}/indices")
 def get_available_frames(video_name: str):
-    file_path = os.path.join(FRAME_DIR, video_name, "frame_indices.json")
-    if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="Frame indices data not found")
-    
-    with open(file_path, "r") as f:
-        return json.load(f)         # list of integers
+    prefetch_video(video_name)
+    return read_json(f"{FRAME_DIR}/{video_name}/frame_indices.json", "Frame indices data not found")     # list of integers
+
+
+def get_frame_pack_from_storage(video_name: str):
+    # the pack (with its index) is memory-mapped from the storage's local copy
+    storage = get_storage()
+    pack_key = f"{FRAME_DIR}/{video_name}/{FRAME_PACK_NAME}"
+    try:
+        pack_path = storage.local_path(pack_key)
+    except (FileNotFoundError, ValueError):
+        return None
+    return get_frame_pack(pack_path)
+
+
+# single extracted frame, sliced out of the video's packed frame store (loose PNG as fallback)
+@app.get("/frame/{video_name}/{frame_index}/image")
+def get_frame_image(video_name: str, frame_index: int):
+    pack = get_frame_pack_from_storage(video_name)
+    if pack is not None and frame_index in pack:
+        return Response(
+            content=bytes(pack.get_bytes(frame_index)),
+            media_type=pack.media_type,
+            headers={"Cache-Control": f"public, max-age={SHORT_MAX_AGE}"}
+        )
+
+    key = f"{FRAME_DIR}/{video_name}/images/{frame_index}_frame.png"
+    return storage_file_response(get_storage(), key, "image/png", SHORT_MAX_AGE)
     
 
+# box labels explained from their OCR text alone; image, table and formula boxes still get both images
+TEXT_ONLY_LABELS = {"text", "header", "doc_title", "paragraph_title"}
+
+def request_session(http_request: Request):
+    """
+    Scheduler session and supersede slot of a request. The frontend sends a per-tab X-Session-Id; without it
+    only the client address is known, which students behind a proxy or NAT share, so such requests are queued
+    per address but never cancel each other.
+    """
+    session_id = http_request.headers.get("X-Session-Id")
+    if session_id:
+        return f"session:{session_id[:128]}", "explain"
+    return f"address:{http_request.client.host if http_request.client else 'anonymous'}", None
+
+
 class ExplainRequest(BaseModel):
     video_name: str
     timestamp: float
     box_id: int
 
 
-@app.post("/explain")
-async def explain(request: ExplainRequest):
-
-    video_name = request.video_name
-    timestamp = request.timestamp
-    box_id = request.box_id
-
-    # === 1. Get transcript (placeholder logic) ===
-    chunks_path = os.path.join(TRANSCRIPT_DIR, video_name, "chunks.json")
-    transcript = get_transcript_chunks_for_pause(chunks_path, timestamp)
+def locate_box(video_name: str, timestamp: float, box_id: int):
+    """
+    Selected frame, box and transcript context of an /explain request. Blocking: the storage may have to
+    download the files first, so it runs in the thread pool.
+    """
+    # shared memory-mapped index if the video was published, otherwise the json files
+    storage = get_storage()
+    index = get_video_index(storage, video_name)
 
-    # === 2. Get image and crop the image box ===
-    # first find the right image    
-    frame_indices = get_available_frames(video_name)
+    # === 1. Find the selected box on the right frame ===
     video_fps = get_metadata(video_name)['fps']
     current_frame_index = math.floor(timestamp * video_fps)
 
-    selected_frame = None
-    for frame in frame_indices:
-        if frame >= current_frame_index:
-            selected_frame = frame
-            break
-
-    frame_img_path = os.path.join(FRAME_DIR, video_name, "images", f"{selected_frame}_frame.png")
-    
-    # retrieve the original box coordinates
-    layout_json_path = os.path.join(LAYOUT_DIR, video_name, "res", f"{selected_frame}_frame.json")
-    box_coordinates = get_box_coordinates(layout_json_path, box_id)
-
-    if not box_coordinates:
+    if index is not None:
+        selected_frame = index.frame_for_index(current_frame_index)
+    else:
+        frame_indices = get_available_frames(video_name)
+        selected_frame = None
+        for frame in frame_indices:
+            if frame >= current_frame_index:
+                selected_frame = frame
+                break
+
+    if index is not None:
+        frame_boxes = index.frame_boxes(selected_frame)
+    else:
+        # retrieve the original box (coordinates, label, OCR text)
+        try:
+            layout_json_path = storage.local_path(f"{LAYOUT_DIR}/{video_name}/res/{selected_frame}_frame.json")
+        except FileNotFoundError:
+            # layouts of a freshly uploaded video may still be running
+            raise HTTPException(status_code=404, detail="Layout data not found")
+        frame_boxes = get_boxes(layout_json_path)
+    box = next((frame_box for frame_box in frame_boxes if frame_box.get('box_id') == box_id), None)
+
+    if not box or not box.get('coordinate'):
         # Handle missing or empty coordinates
         raise ValueError(f"Coordinates missing for box id {box_id}")
-
-    image = Image.open(frame_img_path).convert("RGB")
-    x1, y1, x2, y2 = box_coordinates
+    box_text = box.get('text')
+
+    # === 2. Get transcript context within the token budget ===
+    if index is not None:
+        transcript = build_transcript_context(index.chunks_meta, timestamp, box_text=box_text)
+    else:
+        chunks_path = storage.local_path(f"{TRANSCRIPT_DIR}/{video_name}/chunks.json")
+        transcript = get_transcript_chunks_for_pause(chunks_path, timestamp, box_text=box_text)
+
+    context = index.context_embedding(timestamp) if index is not None else None
+    return selected_frame, box, is_text_only(box, frame_boxes), transcript, context
+
+
+def is_text_only(box: dict, frame_boxes: List[dict]) -> bool:
+    """
+    Text-like boxes with readable OCR text are explained without images, unless they contain something else:
+    text groups (see LayoutModel.indentation_grouping) take in the formulas between their lines. Boxes whose
+    OCR text is only symbols or noise go to the vision model.
+    """
+    if box['label'] not in TEXT_ONLY_LABELS or not normalize_text(box.get('text')):
+        return False
+    member_labels = box.get('member_labels')
+    if member_labels is not None:
+        return set(member_labels) <= TEXT_ONLY_LABELS
+
+    # layouts from before member_labels: look for other boxes whose center lies inside the box
+    x1, y1, x2, y2 = box['coordinate']
+    for other in frame_boxes:
+        if other is box or other['label'] in TEXT_ONLY_LABELS:
+            continue
+        ox1, oy1, ox2, oy2 = other['coordinate']
+        if x1 <= (ox1 + ox2) / 2 <= x2 and y1 <= (oy1 + oy2) / 2 <= y2:
+            return False
+    return True
+
+
+def load_box_image(video_name: str, selected_frame: int, box: dict):
+    # === 3. Get image and crop the image box === (blocking, see locate_box)
+    from PIL import Image
+
+    pack = get_frame_pack_from_storage(video_name)
+    if pack is not None and selected_frame in pack:
+        image = pack.open_image(selected_frame).convert("RGB")
+    else:
+        frame_img_path = get_storage().local_path(f"{FRAME_DIR}/{video_name}/images/{selected_frame}_frame.png")
+        image = Image.open(frame_img_path).convert("RGB")
+    x1, y1, x2, y2 = box['coordinate']
     cropped_box_image = image.crop((x1, y1, x2, y2))
+    return image, cropped_box_image, difference_hash(cropped_box_image)
 
 
-    # === 3. Get GPT-4o explanation (replace with your GPT handler) ===
-    # bring the images into suitable format
-    image_bytes = pil_image_to_bytes(image)
-    cropped_image_bytes = pil_image_to_bytes(cropped_box_image)
-    explanation = get_gpt_explanation(transcript=transcript, cropped_image=cropped_image_bytes, full_slide_image=image_bytes)
+@app.post("/explain")
+async def explain(request: ExplainRequest, http_request: Request):
+    video_name = request.video_name
+    timestamp = request.timestamp
+    box_id = request.box_id
 
-    return {"explanation": explanation}
+    selected_frame, box, text_only, transcript, context = await run_in_threadpool(locate_box, video_name, timestamp, box_id)
+    box_text = box.get('text')
+
+    # upstream calls are scheduled fairly per session; identical requests in flight are shared, and the
+    # call is dropped when the client disconnects or the session asks for another explanation first
+    session, slot = request_session(http_request)
+    # the transcript context depends on the pause position, so only requests with the same context are shared
+    dedup_key = f"{video_name}/{selected_frame}/{box_id}/{hashlib.sha1(transcript.encode('utf-8')).hexdigest()[:16]}"
+
+    # near-identical boxes explained before (other frames, other lectures) are reused, see services/explanation_cache.py
+    reuse_index = get_explanation_index(get_storage()) if EXPLANATION_REUSE_ENABLED else None
+
+    async def reuse_or_generate(fingerprint, generate):
+        match = None
+        if reuse_index and fingerprint.usable:
+            match = await run_in_threadpool(reuse_index.lookup, fingerprint, video_name, selected_frame, box_id)
+        try:
+            if match is not None and match.mode == "same":
+                explanation = match.explanation
+            elif match is not None:
+                explanation = await get_gpt_adapted_explanation_async(
+                    explanation=match.explanation, transcript=transcript,
+                    session=session, key=f"{dedup_key}:adapt", slot=slot, is_disconnected=http_request.is_disconnected
+                )
+            else:
+                explanation = await generate()
+        except RequestCancelled as e:
+            raise HTTPException(status_code=499, detail=f"Request cancelled: {e}")
+
+        if reuse_index and fingerprint.usable and (match is None or match.mode == "adapt"):
+            await run_in_threadpool(reuse_index.add, fingerprint, video_name, selected_frame, box_id, box['label'], explanation)
+        if match is None:
+            return {"explanation": explanation}
+        reused = {"mode": match.mode, "video": match.entry["video"], "frame": match.entry["frame"], "box_id": match.entry["box_id"]}
+        return {"explanation": explanation, "reused": reused}
+
+    # text-like boxes with OCR text don't need the vision model
+    if text_only:
+        fingerprint = Fingerprint("text", None, normalize_text(box_text), context)
+        return await reuse_or_generate(fingerprint, lambda: get_gpt_text_explanation_async(
+            transcript=transcript, box_text=box_text, label=box['label'],
+            session=session, key=dedup_key, slot=slot, is_disconnected=http_request.is_disconnected
+        ))
+
+    image, cropped_box_image, image_hash = await run_in_threadpool(load_box_image, video_name, selected_frame, box)
+    fingerprint = Fingerprint("visual", image_hash, normalize_text(box_text), context)
+
+
+    # === 4. Get GPT-4o explanation (replace with your GPT handler) ===
+    async def generate():
+        # bring the images into suitable format
+        image_bytes = await run_in_threadpool(pil_image_to_bytes, image)
+        cropped_image_bytes = await run_in_threadpool(pil_image_to_bytes, cropped_box_image)
+        return await get_gpt_explanation_async(
+            transcript=transcript, cropped_image=cropped_image_bytes, full_slide_image=image_bytes,
+            session=session, key=dedup_key, slot=slot, is_disconnected=http_request.is_disconnected
+        )
+
+    return await reuse_or_generate(fingerprint, generate)
 
 
 class AssociateRequest(BaseModel):
@@ -170,19 +647,32 @@ class AssociateRequest(BaseModel):
     explanation: str
 
 
-@app.post("/associate")
-async def associate_content(request: AssociateRequest):
-    
-    video_name = request.video_name
-    timestamp = request.timestamp
-    explanation = request.explanation
+def match_chunk(video_name: str, timestamp: float, explanation_embedding: List[float]):
+    """
+    Most similar earlier transcript chunk for /associate (blocking, see locate_box).
+    """
+    import numpy as np
+
+    storage = get_storage()
+    index = get_video_index(storage, video_name)
+    if index is not None:
+        if not len(index.chunk_times) or index.chunk_times[0, 0] > timestamp:
+            return {"error": "No prior chunks to compare with."}
+
+        # making sure that the user is not directly navigated to the section right before
+        best_index, best_sim = index.most_similar_chunk(explanation_embedding, max_start=timestamp, exclude_last=4)
+        if best_index is None:
+            return {"error": "No matching chunk found."}
 
-    explanation_embedding = get_gpt_embedding(explanation)
+        best_chunk = index.chunks_meta[best_index]
+        return {
+            "start": best_chunk["start"],
+            "label": best_chunk.get("label"),
+            "similarity": best_sim,
+        }
 
     # Load chunks
-    chunks_path = os.path.join(TRANSCRIPT_DIR, video_name, "chunks.json")
-    with open(chunks_path, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    chunks = storage.read_json(f"{TRANSCRIPT_DIR}/{video_name}/chunks.json")
     
     past_chunks = [chunk for chunk in chunks if chunk["start"] <= timestamp]
     if not past_chunks:
@@ -207,6 +697,17 @@ async def associate_content(request: AssociateRequest):
     } if best_chunk else {"error": "No matching chunk found."}
 
 
+@app.post("/associate")
+async def associate_content(request: AssociateRequest):
+    video_name = request.video_name
+    timestamp = request.timestamp
+    explanation = request.explanation
+
+    explanation_embedding = await get_gpt_embedding_async(explanation)
+
+    return await run_in_threadpool(match_chunk, video_name, timestamp, explanation_embedding)
+
+
 
 
 
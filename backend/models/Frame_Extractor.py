@@ -1,8 +1,8 @@
 import os
-import cv2
 
 class FrameExtractor:
     def __init__(self, video_path, output_dir="./frames"):
+        import cv2
         self.video_path = video_path
         self.output_dir = output_dir
         self.img_output_dir = os.path.join(output_dir, "images")
@@ -11,6 +11,7 @@ class FrameExtractor:
         self.fps = self.cap.get(cv2.CAP_PROP_FPS)
 
     def get_frames_and_store(self, frame_indices):
+        import cv2
         for idx in frame_indices:
             cap = cv2.VideoCapture(self.video_path)
             if not cap.isOpened():
@@ -1,14 +1,23 @@
-import numpy as np
-from openai import OpenAI
-from typing import List, Union
+from typing import TYPE_CHECKING, List, Union
 from pathlib import Path
 import base64
 
+if TYPE_CHECKING:
+    import numpy as np
+
 class GPTModel:
     _instance = None
 
     def __init__(self):
-        self.client = OpenAI()  # Uses OPENAI_API_KEY from env
+        # the OpenAI client is created on first use: importing the openai SDK alone takes ~1s
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI()  # Uses OPENAI_API_KEY from env
+        return self._client
 
     @classmethod
     def get_instance(cls):
@@ -25,7 +34,8 @@ class GPTModel:
         return [e.embedding for e in response.data]
 
 
-    def cosine_sim(self, a: np.ndarray, b: np.ndarray) -> float:
+    def cosine_sim(self, a: "np.ndarray", b: "np.ndarray") -> float:
+        import numpy as np
         return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
     
 
@@ -39,6 +49,17 @@ class GPTModel:
         )
         return response.choices[0].message.content.strip()
 
+    def summarize_chunk(self, chunk_text: str) -> str:
+        # compact stand-in for the chunk when its full text doesn't fit the explain prompt's token budget
+        response = self.client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "Summarize this lecture transcript chunk in one or two short sentences. Keep technical terms."},
+                {"role": "user", "content": chunk_text}
+            ]
+        )
+        return response.choices[0].message.content.strip()
+
     def _encode_image(self, image: Union[str, Path, bytes]) -> str:
         if isinstance(image, (str, Path)):
             with open(image, "rb") as f:
@@ -96,3 +117,57 @@ class GPTModel:
         )
 
         return response.choices[0].message.content.strip()
+
+
+    def explain_text(self, transcript: str, box_text: str, label: str = "text") -> str:
+        # cheaper variant of explain() for text-like boxes: the OCR text replaces both images
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a concise tutor AI. "
+                    "Explain the selected slide region clearly in 1–3 sentences, using the transcript for context. "
+                    "The region's text was extracted by OCR and may contain small recognition errors."
+                )
+            },
+            {
+                "role": "user",
+                "content": f"Transcript:\n{transcript}\n\nSelected region ({label}):\n{box_text}"
+            }
+        ]
+
+        response = self.client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.4
+        )
+
+        return response.choices[0].message.content.strip()
+
+
+    def adapt_explanation(self, explanation: str, transcript: str) -> str:
+        # rewrites an explanation generated for the same slide region in another part of the lecture
+        # (or another lecture); a small text-only call instead of a new vision request
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a concise tutor AI. "
+                    "Below is an explanation of a slide region that was written for a different part of a lecture. "
+                    "Adapt it to the given transcript in 1–3 sentences. Keep what is still correct, "
+                    "drop references that don't fit the new context."
+                )
+            },
+            {
+                "role": "user",
+                "content": f"Transcript:\n{transcript}\n\nExisting explanation:\n{explanation}"
+            }
+        ]
+
+        response = self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=0.3
+        )
+
+        return response.choices[0].message.content.strip()
@@ -1,50 +1,93 @@
 # Singleton class for Layout Model from Paddle
 
-from paddlex import create_model
-from PIL import Image, UnidentifiedImageError
 import os
+from .OCR_Model import BoxOCR
 
-class LayoutModel:
-    _instance = None
+# prediction settings shared by both inference backends
+PREDICT_OPTIONS = dict(
+    layout_nms=True,
+    threshold={10: 0.45, 12: 0.45},         # 10: doc_title, 12: header
+    layout_merge_bboxes_mode="large"
+)
 
-    def __init__(self, input_dir, output_dir="./layouts", model_name="PP-DocLayout_plus-L"):
+class LayoutModel:
+    _instances = {}         # one model per backend, model and thread setting
+
+    def __init__(self, input_dir, output_dir="./layouts", model_name="PP-DocLayout_plus-L", with_ocr=False,
+                 backend="paddle", onnx_model_path=None, intra_op_threads=None, inter_op_threads=1, batch_size=1):
+        """
+        backend: "paddle" (paddlex create_model) or "onnx" (ONNX Runtime on the exported, optionally int8
+                 model at onnx_model_path, see Program_Layout_Onnx.py); both produce the same box dicts
+        """
         self.output_dir = output_dir
         self.input_dir = input_dir
+        self.batch_size = batch_size
         os.makedirs(os.path.join(output_dir, "res"), exist_ok=True)
         os.makedirs(os.path.join(output_dir, "images"), exist_ok=True)
-        self.model = self.get_instance(model_name)
+        self.model = self.get_instance(model_name, backend, onnx_model_path, intra_op_threads, inter_op_threads)
+        # with_ocr: store the recognized text of every box as "text" in the layout json
+        self.ocr = BoxOCR() if with_ocr else None
 
     @classmethod
-    def get_instance(cls, model_name="PP-DocLayout_plus-L"):
-        if cls._instance is None:
-            cls._instance = create_model(model_name=model_name)
-        return cls._instance
+    def get_instance(cls, model_name="PP-DocLayout_plus-L", backend="paddle", onnx_model_path=None, intra_op_threads=None, inter_op_threads=1):
+        if backend == "onnx":
+            key = (backend, os.path.abspath(onnx_model_path) if onnx_model_path else None, intra_op_threads, inter_op_threads)
+        else:
+            key = (backend, model_name)
+        if key not in cls._instances:
+            if backend == "onnx":
+                from .Layout_Onnx_Model import OnnxLayoutModel
+                if not onnx_model_path:
+                    raise ValueError("The onnx backend needs onnx_model_path")
+                cls._instances[key] = OnnxLayoutModel(onnx_model_path, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+            else:
+                # paddlex pulls in the whole paddle runtime, only import it once a model is really needed
+                from paddlex import create_model
+                cls._instances[key] = create_model(model_name=model_name)
+        return cls._instances[key]
     
     # input: path to the one frame/slide that's currently depicted
     def run_and_store(self, frame_path):                 
-        
+        return self.run_and_store_batch([frame_path])[0]
+
+
+    def image_size(self, frame_path):
+        from PIL import Image, UnidentifiedImageError
+
         # error handling if frame_path does not contain image
         if not os.path.isfile(frame_path):
             raise FileNotFoundError(f"File not found: {frame_path}")
 
         try:
             with Image.open(frame_path) as img:
-                img_width, img_height = img.size
+                return img.size
         except UnidentifiedImageError:
             raise ValueError(f"File is not a valid image: {frame_path}")
-        
+
+
+    # several frames per inference call; the frames must be valid images (see image_size)
+    def run_and_store_batch(self, frame_paths):
+        sizes = [self.image_size(frame_path) for frame_path in frame_paths]
 
         # predict output, postprocess output
-        prediction = self.model.predict(
-            frame_path,
-            batch_size=1,
-            layout_nms=True,
-            threshold={10: 0.45, 12: 0.45},         # 10: doc_title, 12: header
-            layout_merge_bboxes_mode="large"
-        )  
-
-        output = [prediction, img_width, img_height]
+        predictions = self.model.predict(
+            frame_paths,
+            batch_size=len(frame_paths),
+            **PREDICT_OPTIONS
+        )
+
+        stored = []
+        for frame_path, (img_width, img_height), prediction in zip(frame_paths, sizes, predictions):
+            output = [iter([prediction]), img_width, img_height]
+            stored.append(self.postprocess_and_store(frame_path, output))
+        return stored
+
+
+    def postprocess_and_store(self, frame_path, output):
         res = self.postprocessing(output)
+
+        if self.ocr is not None:
+            self.ocr.recognize_boxes(frame_path, res['boxes'])
        
         # save results
         frame_index = os.path.splitext(os.path.basename(frame_path))[0]        
@@ -57,12 +100,16 @@ class LayoutModel:
         return res_json_path, res_img_path
     
 
-    def run_and_store_all_frames(self):
+    def run_and_store_all_frames(self, progress_callback=None):
+        """
+        progress_callback(done, total) is called after every batch of frames.
+        """
         if not os.path.isdir(self.input_dir):
             raise NotADirectoryError(f"Provided path is not a directory: {self.input_dir}")
 
         supported_extensions = {'.png', '.jpg', '.jpeg'}
 
+        file_paths = []
         for filename in os.listdir(self.input_dir):
             file_path = os.path.join(self.input_dir, filename)
 
@@ -74,13 +121,32 @@ class LayoutModel:
                 continue  # Skip unsupported files
 
             try:
-                res_json_path, res_img_path = self.run_and_store(file_path)
+                self.image_size(file_path)
             except Exception as e:
                 print(f"Error processing {file_path}: {e}")
+                continue
+            file_paths.append(file_path)
+
+        for start in range(0, len(file_paths), self.batch_size):
+            self._run_batch_safely(file_paths[start:start + self.batch_size])
+            if progress_callback is not None:
+                progress_callback(min(start + self.batch_size, len(file_paths)), len(file_paths))
 
         return self.output_dir
 
 
+    def _run_batch_safely(self, frame_paths):
+        try:
+            self.run_and_store_batch(frame_paths)
+        except Exception as e:
+            if len(frame_paths) == 1:
+                print(f"Error processing {frame_paths[0]}: {e}")
+                return
+            # retry one by one, so a single broken frame doesn't cost the whole batch
+            for frame_path in frame_paths:
+                self._run_batch_safely([frame_path])
+
+
     def indentation_grouping(self, sorted_boxes, indent_threshold, allowed_labels):
         grouped_boxes = []
         current_group = None
@@ -99,7 +165,8 @@ class LayoutModel:
                     current_group = {
                         'cls_id': 2,
                         'label': "text",
-                        'coordinate': [xmin, ymin, xmax, ymax]
+                        'coordinate': [xmin, ymin, xmax, ymax],
+                        'member_labels': [label]        # a group with a formula is not explained from its text alone
                     }
                     group_scores = [score]
                     current_xmin = xmin
@@ -113,6 +180,7 @@ class LayoutModel:
                         group_coords[3] = max(group_coords[3], ymax)
 
                         group_scores.append(score)
+                        current_group['member_labels'].append(label)
                     else:
                         # Finalize previous group
                         current_group['score'] = min(group_scores)
@@ -122,7 +190,8 @@ class LayoutModel:
                         current_group = {
                             'cls_id': 2,
                             'label': "text",
-                            'coordinate': [xmin, ymin, xmax, ymax]
+                            'coordinate': [xmin, ymin, xmax, ymax],
+                            'member_labels': [label]
                         }
                         current_xmin = xmin
                         group_scores = [score]
@@ -137,6 +206,7 @@ class LayoutModel:
                     group_coords[3] = max(group_coords[3], ymax)
 
                     group_scores.append(score)
+                    current_group['member_labels'].append(label)
 
                 # Also add the formula as a standalone box
                 grouped_boxes.append(box)
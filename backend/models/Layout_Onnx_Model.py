@@ -0,0 +1,340 @@
+# ONNX Runtime inference path for the layout detection model (PP-DocLayout_plus-L exported with paddle2onnx,
+# optionally quantized to int8). predict() mirrors the paddlex model API that LayoutModel uses: it yields
+# one result per image with a "boxes" list of {cls_id, label, score, coordinate} and save_to_json/save_to_img,
+# so LayoutModel.postprocessing and indentation_grouping work unchanged.
+
+import json
+import os
+import subprocess
+import sys
+
+# label order of PP-DocLayout_plus-L, used when the model directory has no inference.yml
+DEFAULT_LABELS = [
+    "paragraph_title", "image", "text", "number", "abstract", "content", "figure_title", "formula",
+    "table", "reference", "doc_title", "footnote", "header", "algorithm", "footer", "seal", "chart",
+    "formula_number", "aside_text", "reference_content",
+]
+DEFAULT_INPUT_SIZE = (800, 800)         # height, width
+DEFAULT_THRESHOLD = 0.5
+
+# same values as the paddlex layout post-processing
+NMS_IOU_SAME_CLASS = 0.6
+NMS_IOU_OTHER_CLASS = 0.98
+CONTAINMENT_RATIO = 0.8
+
+
+class LayoutResult(dict):
+    # decoded RGB image of the prediction, kept out of the json
+    image = None
+
+    def save_to_json(self, save_path):
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(self, f, indent=4, ensure_ascii=False)
+
+    def save_to_img(self, save_path):
+        from PIL import Image, ImageDraw
+
+        image = Image.fromarray(self.image) if self.image is not None else Image.open(self["input_path"]).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        for box in self["boxes"]:
+            x1, y1, x2, y2 = box["coordinate"]
+            color = _label_color(box["cls_id"])
+            draw.rectangle((x1, y1, x2, y2), outline=color, width=3)
+            draw.text((x1 + 4, y1 + 2), f"{box['label']} {box['score']:.2f}", fill=color)
+        image.save(save_path)
+
+
+def _label_color(cls_id):
+    palette = [(230, 25, 75), (60, 180, 75), (0, 130, 200), (245, 130, 48), (145, 30, 180), (70, 240, 240), (240, 50, 230)]
+    return palette[cls_id % len(palette)]
+
+
+class OnnxLayoutModel:
+    def __init__(self, model_path, model_dir=None, intra_op_threads=None, inter_op_threads=1, batch_size=1):
+        """
+        Args:
+            model_path (str): .onnx file (float32 or int8)
+            model_dir (str): paddle model directory with inference.yml (labels, input size);
+                             defaults to the directory of the .onnx file
+            intra_op_threads (int): threads inside one operator (None: onnxruntime default, all cores)
+            inter_op_threads (int): operators run in parallel (>1 switches to parallel execution mode)
+            batch_size (int): default number of images per inference call
+        """
+        import onnxruntime as ort
+
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.labels, self.input_size = self.read_config(model_dir or os.path.dirname(os.path.abspath(model_path)))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads and inter_op_threads > 1:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    @staticmethod
+    def read_config(model_dir):
+        config_path = os.path.join(model_dir, "inference.yml")
+        if not os.path.isfile(config_path):
+            return DEFAULT_LABELS, DEFAULT_INPUT_SIZE
+
+        import yaml
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+
+        labels = config.get("label_list") or DEFAULT_LABELS
+        input_size = DEFAULT_INPUT_SIZE
+        for step in config.get("Preprocess", []):
+            if step.get("type") == "Resize" and step.get("target_size"):
+                input_size = tuple(step["target_size"])
+        return labels, input_size
+
+    def preprocess(self, image):
+        """
+        Args:
+            image (str | numpy.ndarray): image path or BGR array (like cv2.imread returns it)
+
+        Returns:
+            (float32 CHW array, RGB array, original height, original width)
+        """
+        import cv2
+        import numpy as np
+
+        if isinstance(image, str):
+            bgr = cv2.imread(image)
+            if bgr is None:
+                raise ValueError(f"File is not a valid image: {image}")
+        else:
+            bgr = image
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        height, width = rgb.shape[:2]
+
+        # Resize without keeping the aspect ratio (cubic), scale to [0, 1], HWC -> CHW
+        target_height, target_width = self.input_size
+        resized = cv2.resize(rgb, (target_width, target_height), interpolation=cv2.INTER_CUBIC)
+        tensor = resized.astype(np.float32).transpose(2, 0, 1) / 255.0
+        return tensor, rgb, height, width
+
+    def predict(self, input, batch_size=None, layout_nms=True, threshold=DEFAULT_THRESHOLD, layout_merge_bboxes_mode=None, keep_image=False):
+        """
+        Same call as the paddlex layout model's predict. `input` is one image (path or BGR array) or a list
+        of them; yields one LayoutResult per image.
+        """
+        import numpy as np
+
+        images = input if isinstance(input, list) else [input]
+        batch_size = batch_size or self.batch_size
+
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            prepared = [self.preprocess(image) for image in batch]
+
+            target_height, target_width = self.input_size
+            feeds = {
+                "image": np.stack([tensor for tensor, _, _, _ in prepared]),
+                "im_shape": np.array([[target_height, target_width]] * len(batch), dtype=np.float32),
+                "scale_factor": np.array([[target_height / height, target_width / width] for _, _, height, width in prepared], dtype=np.float32),
+            }
+            outputs = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})
+
+            # fetch 0: rows of (class, score, x1, y1, x2, y2) in original image coordinates for all images,
+            # fetch 1: number of rows per image
+            detections, counts = outputs[0], outputs[1]
+            offset = 0
+            for image, (_, rgb, height, width), count in zip(batch, prepared, counts.reshape(-1)):
+                rows = detections[offset:offset + int(count)]
+                offset += int(count)
+                boxes = self.postprocess(rows, width, height, threshold, layout_nms, layout_merge_bboxes_mode)
+
+                result = LayoutResult(
+                    input_path=image if isinstance(image, str) else None,
+                    page_index=None,
+                    boxes=boxes,
+                )
+                if keep_image or not isinstance(image, str):
+                    result.image = rgb
+                yield result
+
+    def postprocess(self, rows, width, height, threshold, layout_nms, layout_merge_bboxes_mode):
+        import numpy as np
+
+        rows = np.asarray(rows, dtype=np.float32)[:, :6].reshape(-1, 6)
+        rows = rows[rows[:, 0] >= 0]
+        classes = rows[:, 0].astype(np.int64)
+
+        # per-class score thresholds, classes without an entry use the default
+        if isinstance(threshold, dict):
+            class_thresholds = np.array([threshold.get(int(cls_id), DEFAULT_THRESHOLD) for cls_id in classes], dtype=np.float32)
+        else:
+            class_thresholds = np.full(len(rows), threshold, dtype=np.float32)
+        rows = rows[rows[:, 1] > class_thresholds]
+
+        rows[:, [2, 4]] = np.clip(rows[:, [2, 4]], 0, width)
+        rows[:, [3, 5]] = np.clip(rows[:, [3, 5]], 0, height)
+        rows = rows[(rows[:, 4] > rows[:, 2]) & (rows[:, 5] > rows[:, 3])]
+
+        if layout_nms and len(rows):
+            rows = rows[self.nms(rows)]
+        if layout_merge_bboxes_mode and len(rows):
+            rows = self.merge_boxes(rows, layout_merge_bboxes_mode)
+
+        rows = rows[np.argsort(-rows[:, 1], kind="stable")]
+        return [
+            {
+                "cls_id": int(row[0]),
+                "label": self.labels[int(row[0])] if int(row[0]) < len(self.labels) else str(int(row[0])),
+                "score": float(row[1]),
+                "coordinate": [float(value) for value in row[2:6]],
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def _pairwise_intersections(rows):
+        import numpy as np
+        x1 = np.maximum(rows[:, None, 2], rows[None, :, 2])
+        y1 = np.maximum(rows[:, None, 3], rows[None, :, 3])
+        x2 = np.minimum(rows[:, None, 4], rows[None, :, 4])
+        y2 = np.minimum(rows[:, None, 5], rows[None, :, 5])
+        return np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    @staticmethod
+    def _areas(rows):
+        return (rows[:, 4] - rows[:, 2]) * (rows[:, 5] - rows[:, 3])
+
+    def nms(self, rows):
+        """
+        Greedy NMS by score: a box is suppressed by a better box of the same class above
+        NMS_IOU_SAME_CLASS IoU, or of another class above NMS_IOU_OTHER_CLASS. Returns kept row indices.
+        """
+        import numpy as np
+        areas = self._areas(rows)
+        intersections = self._pairwise_intersections(rows)
+        ious = intersections / (areas[:, None] + areas[None, :] - intersections + 1e-9)
+        same_class = rows[:, None, 0] == rows[None, :, 0]
+        limits = np.where(same_class, NMS_IOU_SAME_CLASS, NMS_IOU_OTHER_CLASS)
+
+        order = np.argsort(-rows[:, 1], kind="stable")
+        suppressed = np.zeros(len(rows), dtype=bool)
+        keep = []
+        for i in order:
+            if suppressed[i]:
+                continue
+            keep.append(i)
+            suppressed |= ious[i] >= limits[i]
+        return np.array(keep, dtype=np.int64)
+
+    def _containment(self, rows):
+        # contained[i, j]: box i lies (mostly) inside box j; formulas are never absorbed by other labels
+        import numpy as np
+        intersections = self._pairwise_intersections(rows)
+        contained = intersections / (self._areas(rows)[:, None] + 1e-9) >= CONTAINMENT_RATIO
+        np.fill_diagonal(contained, False)
+        if "formula" in self.labels:
+            is_formula = rows[:, 0] == self.labels.index("formula")
+            contained[np.ix_(is_formula, ~is_formula)] = False
+        return contained
+
+    def merge_boxes(self, rows, mode):
+        """
+        "large" drops boxes inside another box, "small" drops boxes that contain others (boxes that are
+        both stay).
+        """
+        contained = self._containment(rows)
+        contains_other, contained_by_other = contained.any(axis=0), contained.any(axis=1)
+        if mode == "large":
+            return rows[~contained_by_other | contains_other]
+        if mode == "small":
+            return rows[~contains_other | contained_by_other]
+        return rows
+
+
+def export_to_onnx(paddle_model_dir, onnx_path, opset_version=16):
+    """
+    Converts the paddle inference model (inference.json/.pdmodel + inference.pdiparams, e.g. from
+    ~/.paddlex/official_models/PP-DocLayout_plus-L) with paddle2onnx and copies its inference.yml next to it.
+    """
+    import shutil
+
+    model_filename = "inference.json" if os.path.isfile(os.path.join(paddle_model_dir, "inference.json")) else "inference.pdmodel"
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    subprocess.run([
+        sys.executable, "-m", "paddle2onnx",
+        "--model_dir", paddle_model_dir,
+        "--model_filename", model_filename,
+        "--params_filename", "inference.pdiparams",
+        "--save_file", onnx_path,
+        "--opset_version", str(opset_version),
+        "--enable_onnx_checker", "True",
+    ], check=True)
+
+    config_path = os.path.join(paddle_model_dir, "inference.yml")
+    if os.path.isfile(config_path):
+        shutil.copy(config_path, os.path.join(os.path.dirname(os.path.abspath(onnx_path)), "inference.yml"))
+    return onnx_path
+
+
+class _CalibrationReader:
+    # feeds preprocessed frames to the static int8 quantization, one image per call
+    def __init__(self, model, images):
+        self.model = model
+        self.images = list(images)
+        self.position = 0
+
+    def get_next(self):
+        import numpy as np
+        if self.position >= len(self.images):
+            return None
+        tensor, _, height, width = self.model.preprocess(self.images[self.position])
+        self.position += 1
+        target_height, target_width = self.model.input_size
+        feeds = {
+            "image": tensor[None],
+            "im_shape": np.array([[target_height, target_width]], dtype=np.float32),
+            "scale_factor": np.array([[target_height / height, target_width / width]], dtype=np.float32),
+        }
+        return {name: value for name, value in feeds.items() if name in self.model.input_names}
+
+
+def quantize_to_int8(onnx_path, int8_path, calibration_images=None):
+    """
+    int8 weights for the CPU path. With calibration images (paths or BGR arrays of typical slides) the
+    activations are quantized statically (QDQ, per channel), which also covers the convolutions of the
+    backbone; without them only the weights are quantized (dynamic quantization).
+    """
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared_path = onnx_path.replace(".onnx", ".prep.onnx")
+    quant_pre_process(onnx_path, prepared_path, skip_symbolic_shape=True)
+
+    # the detection head (score/box decoding, top-k) stays in float32, it is tiny and sensitive to rounding
+    model = OnnxLayoutModel(prepared_path)
+    nodes_to_exclude = [node.name for node in _graph_nodes(prepared_path) if node.op_type in ("TopK", "GatherElements", "Sigmoid", "Softmax")]
+
+    if calibration_images:
+        quantize_static(
+            prepared_path, int8_path, _CalibrationReader(model, calibration_images),
+            quant_format=QuantFormat.QDQ, per_channel=True,
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+            nodes_to_exclude=nodes_to_exclude,
+        )
+    else:
+        quantize_dynamic(prepared_path, int8_path, weight_type=QuantType.QInt8, nodes_to_exclude=nodes_to_exclude)
+
+    os.remove(prepared_path)
+    config_path = os.path.join(os.path.dirname(os.path.abspath(onnx_path)), "inference.yml")
+    int8_config_path = os.path.join(os.path.dirname(os.path.abspath(int8_path)), "inference.yml")
+    if os.path.isfile(config_path) and not os.path.isfile(int8_config_path):
+        import shutil
+        shutil.copy(config_path, int8_config_path)
+    return int8_path
+
+
+def _graph_nodes(onnx_path):
+    import onnx
+    return onnx.load(onnx_path, load_external_data=False).graph.node
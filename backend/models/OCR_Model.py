@@ -0,0 +1,61 @@
+# Singleton class for the PaddleOCR pipeline (from paddlex), used to read the text of each layout box
+
+import os
+
+class BoxOCR:
+    _instance = None
+
+    def __init__(self, pipeline_name="OCR", device="cpu"):
+        self.pipeline = self.get_instance(pipeline_name, device)
+
+    @classmethod
+    def get_instance(cls, pipeline_name="OCR", device="cpu"):
+        if cls._instance is None:
+            from paddlex import create_pipeline
+            cls._instance = create_pipeline(pipeline=pipeline_name, device=device)
+        return cls._instance
+
+    def recognize(self, image):
+        """
+        Args:
+            image (PIL.Image): Cropped box region
+
+        Returns:
+            str: Recognized text lines joined in reading order (top-down)
+        """
+        import numpy as np
+
+        # paddlex expects BGR arrays like cv2.imread returns them
+        bgr = np.ascontiguousarray(np.array(image.convert("RGB"))[:, :, ::-1])
+        result = next(iter(self.pipeline.predict(
+            bgr,
+            use_doc_orientation_classify=False,     # slides are never rotated or warped
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+        )))
+        return " ".join(text.strip() for text in result["rec_texts"] if text.strip())
+
+    def recognize_boxes(self, frame_path, boxes, min_size=8):
+        """
+        Adds the recognized text of every box as box["text"] (in place).
+        """
+        from PIL import Image
+
+        if not os.path.isfile(frame_path):
+            raise FileNotFoundError(f"File not found: {frame_path}")
+
+        with Image.open(frame_path) as img:
+            frame = img.convert("RGB")
+
+        for box in boxes:
+            x1, y1, x2, y2 = box["coordinate"]
+            if x2 - x1 < min_size or y2 - y1 < min_size:
+                box["text"] = ""
+                continue
+            try:
+                box["text"] = self.recognize(frame.crop((x1, y1, x2, y2)))
+            except Exception as e:
+                print(f"OCR failed for box {box.get('box_id')} in {frame_path}: {e}")
+                box["text"] = ""
+
+        return boxes
@@ -0,0 +1,146 @@
+import json
+import os
+import subprocess
+import time
+
+# packs small thumbnails of the extracted slide frames into a few sprite-sheet images and writes a
+# WebVTT thumbnail track ("<sprite>#xywh=x,y,w,h" per time range) for timeline previews
+class ThumbnailSpriteBuilder:
+    def __init__(self, frames_dir, metadata_path, output_dir="./thumbnails", thumb_width=160, columns=8, rows=8, quality=70,
+                 video_path=None, ffprobe_bin="ffprobe"):
+        """
+        Args:
+            frames_dir (str): Output directory of the FrameExtractor (with images/ and frame_indices.json)
+            metadata_path (str): metadata.json of the video (fps, width, height, optional duration)
+            video_path (str): Optional, the video itself; its duration (ffprobe) ends the last cue when
+                              metadata.json has none
+            thumb_width (int): Width of one thumbnail in pixels, the height follows the video aspect ratio
+            columns (int), rows (int): Thumbnails per sprite sheet
+        """
+        self.frames_dir = frames_dir
+        self.output_dir = output_dir
+        self.thumb_width = thumb_width
+        self.columns = columns
+        self.rows = rows
+        self.quality = quality
+        self.video_path = video_path
+        self.ffprobe_bin = ffprobe_bin
+        self.build_id = None
+
+        with open(metadata_path, "r") as f:
+            self.metadata = json.load(f)
+        with open(os.path.join(frames_dir, "frame_indices.json"), "r") as f:
+            self.frame_indices = sorted(json.load(f))
+
+        self.thumb_height = int(round(thumb_width * self.metadata["height"] / self.metadata["width"]))
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _load_frame(self, frame_index):
+        from PIL import Image
+        frame_path = os.path.join(self.frames_dir, "images", f"{frame_index}_frame.png")
+        with Image.open(frame_path) as img:
+            return img.convert("RGB").resize((self.thumb_width, self.thumb_height), Image.LANCZOS)
+
+    def _probe_duration(self):
+        if not self.video_path:
+            return None
+        try:
+            output = subprocess.run(
+                [self.ffprobe_bin, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", self.video_path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            return float(output.strip())
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            return None
+
+    def _duration(self):
+        fps = self.metadata["fps"]
+        duration = self.metadata.get("duration") or self._probe_duration()
+        if duration:
+            return duration
+        if not self.frame_indices:
+            return 0
+        # no duration at all: the last slide is shown as long as a typical slide
+        intervals = sorted(b - a for a, b in zip(self.frame_indices, self.frame_indices[1:]))
+        interval = intervals[len(intervals) // 2] if intervals else 1
+        return (self.frame_indices[-1] + interval) / fps
+
+    def build_and_store(self):
+        """
+        Returns:
+            str: Path to the WebVTT thumbnail track
+        """
+        from PIL import Image
+
+        fps = self.metadata["fps"]
+        duration = self._duration()
+
+        # sprite names carry the build id, so they can be cached as immutable
+        build_id = int(time.time())
+        self.build_id = build_id
+        per_sheet = self.columns * self.rows
+        cues = []
+        sheet_names = []
+
+        for sheet_number, sheet_start in enumerate(range(0, len(self.frame_indices), per_sheet)):
+            sheet_frames = self.frame_indices[sheet_start:sheet_start + per_sheet]
+            used_rows = (len(sheet_frames) + self.columns - 1) // self.columns
+            used_columns = min(len(sheet_frames), self.columns)
+            sheet = Image.new("RGB", (used_columns * self.thumb_width, used_rows * self.thumb_height))
+            sheet_name = f"sprite_{build_id}_{sheet_number}.jpg"
+
+            for position, frame_index in enumerate(sheet_frames):
+                x = (position % self.columns) * self.thumb_width
+                y = (position // self.columns) * self.thumb_height
+                try:
+                    sheet.paste(self._load_frame(frame_index), (x, y))
+                except FileNotFoundError:
+                    print(f"Warning: Frame image missing for index {frame_index}")
+
+                # a slide's preview is shown from its change until the next slide change
+                list_position = sheet_start + position
+                start = frame_index / fps
+                end = self.frame_indices[list_position + 1] / fps if list_position + 1 < len(self.frame_indices) else duration
+                cues.append((start, end, f"{sheet_name}#xywh={x},{y},{self.thumb_width},{self.thumb_height}"))
+
+            sheet.save(os.path.join(self.output_dir, sheet_name), format="JPEG", quality=self.quality, optimize=True)
+            sheet_names.append(sheet_name)
+
+        vtt_path = os.path.join(self.output_dir, "thumbnails.vtt")
+        with open(vtt_path, "w", encoding="utf-8") as f:
+            f.write("WEBVTT\n\n")
+            for start, end, target in cues:
+                f.write(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}\n{target}\n\n")
+
+        return vtt_path
+
+    def earlier_build_files(self):
+        # sprite sheets of earlier builds of this video
+        prefix = f"sprite_{self.build_id}_"
+        return [
+            os.path.join(self.output_dir, filename)
+            for filename in os.listdir(self.output_dir)
+            if filename.startswith("sprite_") and not filename.startswith(prefix)
+        ]
+
+    def remove_earlier_builds(self):
+        """
+        Removes the sprite sheets of earlier builds. build_and_store keeps them, because clients and caches
+        hold the previous thumbnails.vtt for up to its max-age and still request those sheets: call this
+        only once that long has passed since the new track was published.
+
+        Returns:
+            int: Number of removed sprite sheets
+        """
+        files = self.earlier_build_files()
+        for path in files:
+            os.remove(path)
+        return len(files)
+
+
+def _vtt_timestamp(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    secs, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{milliseconds:03d}"
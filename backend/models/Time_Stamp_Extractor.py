@@ -1,4 +1,3 @@
-import cv2
 import os
 import json
 
@@ -7,6 +6,7 @@ import json
 class TimeStampExtractor:
 
     def __init__(self, video_path, sample_rate=0.2, diff_threshold=2, resize_dim=(100, 100)):
+        import cv2
         if not os.path.isfile(video_path):
             raise FileNotFoundError(f"Video file not found: {video_path}")
 
@@ -27,12 +27,14 @@ class TimeStampExtractor:
             self.cap.release()
 
     def _process_frame(self, frame):
+        import cv2
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         resized = cv2.resize(gray, self.resize_dim)
         return resized    
 
 
     def extract_timestamps_and_store(self, output_dir):
+        import cv2
         ret, prev_frame = self.cap.read()
         if not ret:
             raise ValueError("Cannot read video")
@@ -1,9 +1,11 @@
 import json
 import os
-from openai import OpenAI
-import numpy as np
 from typing import List, Dict, Optional
-from GPT_Model import GPTModel
+from .GPT_Model import GPTModel
+
+# per-segment embeddings are kept next to chunks.json (float16, L2-normalized), so the transcript
+# can be re-chunked with other thresholds or methods offline, see Program_Rechunk.py
+SEGMENT_EMBEDDINGS_FILE = "segment_embeddings.npy"
 
 class TranscriptChunker:
     def __init__(self, embed_model: str = "text-embedding-3-small", similarity_threshold: float = 0.26, output_dir=".\transcripts"):
@@ -22,47 +24,134 @@ class TranscriptChunker:
             return []
 
         texts = [seg["text"] for seg in transcript_segments]
-        embeddings = self.client.get_embeddings(texts)
+        embeddings = self.normalize(self.client.get_embeddings(texts))
+        self.check_segment_embeddings(transcript_segments, embeddings)
+        self.store_segment_embeddings(embeddings)
+
+        # if the similarity between two neighboring segments is lower than the threshold,
+        # then they are not chunked together and a new chunk begins
+        boundaries = self.find_boundaries(embeddings, self.similarity_threshold)
+        chunks = self.build_chunks(transcript_segments, boundaries)
 
-        chunks = []
-        current_chunk = {
-            "start": transcript_segments[0]["start"],
-            "end": transcript_segments[0]["end"],
-            "text": transcript_segments[0]["text"],
-        }
-
-        for i in range(1, len(transcript_segments)):
-            sim = self.client.cosine_sim(embeddings[i], embeddings[i - 1])
-
-            # if the similarity between the two segments is lower than the threshold,
-            # then they are not chunked together and a new chunk begins
-            if sim < self.similarity_threshold:
-                if enrich_with_gpt:
-                    current_chunk["label"] = self.client.label_chunk(current_chunk["text"])
-               
-                chunk_embedding = self.client.get_embeddings([current_chunk["text"]])[0]
-                current_chunk["embedding"] = chunk_embedding
-                chunks.append(current_chunk)
-                current_chunk = {
-                    "start": transcript_segments[i]["start"],
-                    "end": transcript_segments[i]["end"],
-                    "text": transcript_segments[i]["text"],
-                }
-            else:
-                current_chunk["end"] = transcript_segments[i]["end"]
-                current_chunk["text"] += " " + transcript_segments[i]["text"]
-
-        # Add final chunk
         if enrich_with_gpt:
-            current_chunk["label"] = self.client.label_chunk(current_chunk["text"])
-        
-        chunk_embedding = self.client.get_embeddings([current_chunk["text"]])[0]
-        current_chunk["embedding"] = chunk_embedding
-        chunks.append(current_chunk)
+            for chunk in chunks:
+                chunk["label"] = self.client.label_chunk(chunk["text"])
+                chunk["summary"] = self.client.summarize_chunk(chunk["text"])
 
+        chunk_embeddings = self.client.get_embeddings([chunk["text"] for chunk in chunks])
+        for chunk, chunk_embedding in zip(chunks, chunk_embeddings):
+            chunk["embedding"] = chunk_embedding
+
+        self.store_chunks(chunks)
+        return chunks
+
+
+    def store_chunks(self, chunks: List[Dict]):
         output_path = os.path.join(self.output_dir, "chunks.json")
 
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(chunks, f, indent=2)
 
+
+    def store_segment_embeddings(self, embeddings):
+        import numpy as np
+        np.save(os.path.join(self.output_dir, SEGMENT_EMBEDDINGS_FILE), embeddings.astype(np.float16))
+
+
+    @staticmethod
+    def load_segment_embeddings(transcripts_dir: str):
+        import numpy as np
+        embeddings = np.load(os.path.join(transcripts_dir, SEGMENT_EMBEDDINGS_FILE)).astype(np.float32)
+        return TranscriptChunker.normalize(embeddings)     # re-normalize after the float16 round trip
+
+
+    @staticmethod
+    def normalize(embeddings):
+        import numpy as np
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+
+    @staticmethod
+    def find_boundaries(embeddings, similarity_threshold: float) -> List[int]:
+        """
+        Indices i of the segments that start a new chunk, because their cosine similarity to
+        segment i-1 is below the threshold. Embeddings must be L2-normalized.
+        """
+        import numpy as np
+        if len(embeddings) < 2:
+            return []
+        adjacent_sims = np.einsum("ij,ij->i", embeddings[1:], embeddings[:-1])
+        return (np.flatnonzero(adjacent_sims < similarity_threshold) + 1).tolist()
+
+
+    @staticmethod
+    def find_texttiling_boundaries(embeddings, window: int = 3, depth_cutoff: Optional[float] = None) -> List[int]:
+        """
+        TextTiling-style segmentation on embeddings: the gap before segment i is scored by the cosine
+        similarity of the mean embeddings of the `window` segments before and after it. Gaps at local
+        minima whose depth (rise to the nearest peak on both sides) exceeds the cutoff become
+        boundaries. Default cutoff is mean - std/2 of the depth scores (Hearst).
+        """
+        import numpy as np
+        count = len(embeddings)
+        if count < 2:
+            return []
+
+        # prefix sums give every window mean in one pass
+        prefix = np.vstack([np.zeros((1, embeddings.shape[1]), dtype=np.float32), np.cumsum(embeddings, axis=0)])
+        gaps = np.arange(1, count)
+        left_start = np.maximum(gaps - window, 0)
+        right_end = np.minimum(gaps + window, count)
+        left = TranscriptChunker.normalize(prefix[gaps] - prefix[left_start])
+        right = TranscriptChunker.normalize(prefix[right_end] - prefix[gaps])
+        scores = np.einsum("ij,ij->i", left, right)
+
+        # depth: climb to the nearest peak on each side
+        depths = np.zeros(len(scores), dtype=np.float32)
+        for i in range(len(scores)):
+            left_peak = i
+            while left_peak > 0 and scores[left_peak - 1] >= scores[left_peak]:
+                left_peak -= 1
+            right_peak = i
+            while right_peak < len(scores) - 1 and scores[right_peak + 1] >= scores[right_peak]:
+                right_peak += 1
+            depths[i] = (scores[left_peak] - scores[i]) + (scores[right_peak] - scores[i])
+
+        if depth_cutoff is None:
+            depth_cutoff = depths.mean() - depths.std() / 2
+
+        is_valley = np.ones(len(scores), dtype=bool)
+        is_valley[1:] &= scores[1:] <= scores[:-1]
+        is_valley[:-1] &= scores[:-1] <= scores[1:]
+
+        return (gaps[is_valley & (depths > depth_cutoff) & (depths > 0)]).tolist()
+
+
+    @staticmethod
+    def check_segment_embeddings(transcript_segments: List[Dict], embeddings):
+        # one embedding row per segment, otherwise boundaries and segment ranges point at the wrong segments
+        if len(embeddings) != len(transcript_segments):
+            raise ValueError(
+                f"{len(transcript_segments)} transcript segments but {len(embeddings)} segment embeddings"
+            )
+
+
+    @staticmethod
+    def build_chunks(transcript_segments: List[Dict], boundaries: List[int]) -> List[Dict]:
+        if not transcript_segments:
+            return []
+        starts = [0] + [b for b in boundaries if 0 < b < len(transcript_segments)]
+        ends = starts[1:] + [len(transcript_segments)]
+
+        chunks = []
+        for start, end in zip(starts, ends):
+            segments = transcript_segments[start:end]
+            chunks.append({
+                "start": segments[0]["start"],
+                "end": segments[-1]["end"],
+                "text": " ".join(seg["text"] for seg in segments),
+                "segment_range": [start, end],
+            })
         return chunks
@@ -1,4 +1,3 @@
-import whisper
 import os
 import json
 
@@ -10,12 +9,21 @@ class WhisperTranscriber:
         Args:
             model_size (str): One of ["tiny", "base", "small", "medium", "large"]
         """
-        print(f"Loading Whisper model: {model_size}")
-        self.model = whisper.load_model(model_size)
+        self.model_size = model_size
+        self._model = None
         self.video_path = video_path
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
 
+    @property
+    def model(self):
+        # whisper (and torch behind it) is only loaded when the first transcription is requested
+        if self._model is None:
+            import whisper
+            print(f"Loading Whisper model: {self.model_size}")
+            self._model = whisper.load_model(self.model_size)
+        return self._model
+
 
     def transcribe_and_store(self, language=None, task="transcribe"):
         """
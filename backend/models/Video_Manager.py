@@ -1,6 +1,5 @@
 import shutil
 import os
-import cv2
 import json
 
 class VideoManager:
@@ -13,15 +12,18 @@ class VideoManager:
 
     @staticmethod
     def store_metadata(video_path: str, dest_dir: str):
+        import cv2
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
         metadata = {
             "fps": fps,
             "width": width,
-            "height": height
+            "height": height,
+            "duration": frame_count / fps if fps else None
         }
 
         os.makedirs(dest_dir, exist_ok=True)
@@ -29,4 +31,5 @@ class VideoManager:
         with open(os.path.join(dest_dir, "metadata.json"), "w") as f:
             json.dump(metadata, f)
 
-        cap.release()
\ No newline at end of file
+        cap.release()
+        return metadata
\ No newline at end of file
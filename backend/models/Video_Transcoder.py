@@ -0,0 +1,134 @@
+import os
+import shutil
+import subprocess
+import time
+
+# rendition ladder for lecture recordings: mostly static slides compress very well, so the
+# bitrates are far below what generic video ladders use. The video is encoded at constant quality
+# (CRF), maxrate only caps the peaks (animations, live drawing)
+DEFAULT_LADDER = [
+    {"name": "1080p", "height": 1080, "crf": 26, "maxrate": "1500k", "audio_bitrate": "96k"},
+    {"name": "720p", "height": 720, "crf": 26, "maxrate": "900k", "audio_bitrate": "96k"},
+    {"name": "480p", "height": 480, "crf": 27, "maxrate": "450k", "audio_bitrate": "64k"},
+]
+
+# transcodes a lecture video into HLS renditions (one media playlist + .ts segments per rendition)
+# and writes a master playlist; needs the ffmpeg binary (already required by whisper)
+class HLSTranscoder:
+    def __init__(self, video_path, output_dir="./hls", segment_seconds=4, ladder=None, ffmpeg_bin="ffmpeg"):
+        if not os.path.isfile(video_path):
+            raise FileNotFoundError(f"Video file not found: {video_path}")
+
+        self.video_path = video_path
+        self.output_dir = output_dir
+        self.segment_seconds = segment_seconds
+        self.ladder = ladder or DEFAULT_LADDER
+        self.ffmpeg_bin = ffmpeg_bin
+        self.build_id = None
+
+        if shutil.which(ffmpeg_bin) is None:
+            raise RuntimeError(f"ffmpeg binary not found: {ffmpeg_bin}")
+
+    def _renditions_for(self, source_height):
+        # no upscaling: only renditions up to the source height (at least the smallest one)
+        if not source_height:
+            return self.ladder
+        renditions = [r for r in self.ladder if r["height"] <= source_height]
+        return renditions or [min(self.ladder, key=lambda r: r["height"])]
+
+    def _transcode_rendition(self, rendition, build_id):
+        rendition_dir = os.path.join(self.output_dir, rendition["name"])
+        os.makedirs(rendition_dir, exist_ok=True)
+
+        command = [
+            self.ffmpeg_bin, "-y", "-loglevel", "error",
+            "-i", self.video_path,
+            "-vf", f"scale=-2:{rendition['height']}",
+            "-c:v", "libx264",
+            "-preset", "slow",
+            "-tune", "stillimage",          # slides: few, large static areas
+            # capped CRF: a -b:v target would turn this into average-bitrate encoding
+            "-crf", str(rendition["crf"]),
+            "-maxrate", rendition["maxrate"],
+            "-bufsize", str(2 * _bitrate_to_bps(rendition["maxrate"])),
+            # one keyframe at the start of every segment, no extra ones on slide changes
+            "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_seconds})",
+            "-sc_threshold", "0",
+            "-c:a", "aac",
+            "-b:a", rendition["audio_bitrate"],
+            "-ac", "1",
+            "-f", "hls",
+            "-hls_time", str(self.segment_seconds),
+            "-hls_playlist_type", "vod",
+            # segment names carry the build id, so they can be cached as immutable
+            "-hls_segment_filename", os.path.join(rendition_dir, f"seg_{build_id}_%05d.ts"),
+            os.path.join(rendition_dir, "index.m3u8"),
+        ]
+        subprocess.run(command, check=True)
+
+    def transcode_and_store(self, source_width=None, source_height=None):
+        """
+        Transcodes every rendition of the ladder and writes master.m3u8.
+
+        Args:
+            source_width (int): Optional, width of the original video (for RESOLUTION in the master playlist)
+            source_height (int): Optional, height of the original video (skips renditions above it)
+
+        Returns:
+            str: Path to the master playlist
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        build_id = int(time.time())
+        self.build_id = build_id
+        renditions = self._renditions_for(source_height)
+
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for rendition in renditions:
+            print(f"Transcoding rendition: {rendition['name']}")
+            self._transcode_rendition(rendition, build_id)
+
+            bandwidth = (_bitrate_to_bps(rendition["maxrate"]) + _bitrate_to_bps(rendition["audio_bitrate"]))
+            stream_info = f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}"
+            if source_width and source_height:
+                width = int(round(source_width * rendition["height"] / source_height / 2)) * 2
+                stream_info += f",RESOLUTION={width}x{rendition['height']}"
+            lines.append(stream_info)
+            lines.append(f"{rendition['name']}/index.m3u8")
+
+        master_path = os.path.join(self.output_dir, "master.m3u8")
+        with open(master_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        return master_path
+
+    def earlier_build_files(self):
+        # segments of earlier builds of this video
+        prefix = f"seg_{self.build_id}_"
+        return [
+            os.path.join(dir_path, filename)
+            for dir_path, _, file_names in os.walk(self.output_dir)
+            for filename in file_names
+            if filename.endswith(".ts") and not filename.startswith(prefix)
+        ]
+
+    def remove_earlier_builds(self):
+        """
+        Removes the segments of earlier builds. transcode_and_store keeps them, because clients and
+        caches hold the previous playlists for up to their max-age and still request those segments:
+        call this only once that long has passed since the new playlists were published.
+
+        Returns:
+            int: Number of removed segments
+        """
+        files = self.earlier_build_files()
+        for path in files:
+            os.remove(path)
+        return len(files)
+
+
+def _bitrate_to_bps(bitrate: str) -> int:
+    if bitrate.endswith("k"):
+        return int(float(bitrate[:-1]) * 1000)
+    if bitrate.endswith("M"):
+        return int(float(bitrate[:-1]) * 1000000)
+    return int(bitrate)
@@ -1,12 +1,20 @@
 import json
 
 
-def get_box_coordinates(json_input_file: str, box_id: int):
+def get_boxes(json_input_file: str):
     with open (json_input_file, "r") as f:
         layoutJson = json.load(f)
-    
-    for box in layoutJson.get("boxes", []):
+    return layoutJson.get("boxes", [])
+
+
+def get_box(json_input_file: str, box_id: int):
+    for box in get_boxes(json_input_file):
         if box.get("box_id") == box_id:
-            return box['coordinate']
+            return box
     
     return None  # if not found
+
+
+def get_box_coordinates(json_input_file: str, box_id: int):
+    box = get_box(json_input_file, box_id)
+    return box['coordinate'] if box else None
@@ -0,0 +1,80 @@
+import asyncio
+import inspect
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent single-text embedding requests for up to `max_wait_ms` (or until
+    `max_batch_size` texts are pending), sends them as one batched call to `embed_fn` (sync, run in
+    a thread, or async) and hands
+    each waiter its own embedding. A waiter that is cancelled before its batch is sent is dropped
+    from the batch.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], Union[List[List[float]], Awaitable[List[List[float]]]]], max_batch_size: int = 64, max_wait_ms: float = 10.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._stats = {"requests": 0, "batches": 0, "texts_sent": 0, "cancelled": 0}
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self._stats["requests"] += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+        # cancelling the caller cancels the future, _flush then leaves the text out
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        live = [(text, future) for text, future in batch if not future.cancelled()]
+        self._stats["cancelled"] += len(batch) - len(live)
+        if not live:
+            return
+
+        # batches are sent concurrently, collecting the next one doesn't wait for the API
+        task = asyncio.get_running_loop().create_task(self._dispatch(live))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # identical texts (e.g. the same cached explanation) are only embedded once
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        self._stats["batches"] += 1
+        self._stats["texts_sent"] += len(unique_texts)
+
+        try:
+            if inspect.iscoroutinefunction(self.embed_fn):
+                embeddings = await self.embed_fn(unique_texts)
+            else:
+                embeddings = await asyncio.to_thread(self.embed_fn, unique_texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text: Dict[str, List[float]] = dict(zip(unique_texts, embeddings))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self) -> Dict:
+        return dict(self._stats, pending=len(self._pending), batches_in_flight=len(self._in_flight))
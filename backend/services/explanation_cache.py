@@ -0,0 +1,497 @@
+import atexit
+import base64
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+# Reuse of explanations across frames and lectures. The same diagram or formula shows up on several
+# slides, so every generated explanation is stored with a fingerprint of its box:
+#
+#   - visual boxes: 64-bit difference hash (dHash) of the box crop, plus the box's OCR text if any
+#   - text boxes (explained from OCR text alone): the normalized OCR text
+#   - the transcript context: embedding of the transcript chunk playing at the time (from the video index),
+#     reduced to CONTEXT_DIMENSIONS by a fixed random projection
+#
+# A new request with a near-identical box (Hamming distance of the hashes within EXPLANATION_REUSE_MAX_DISTANCE,
+# similar OCR text) and a compatible context gets the stored explanation back, or, if the context is only
+# related, a cheap text-only rewrite of it for the new transcript. Lookups use banded hashing (the 64 bits
+# are split into max_distance + 1 bands; two hashes within the distance agree on at least one band), so
+# they stay below a millisecond with tens of thousands of entries.
+#
+# Entries are kept in the storage (services/storage.py), so every API node sees them:
+#
+#   explanations/segments/<writer>-<n>.jsonl   entries of one worker process, appended locally and uploaded
+#                                              every FLUSH_INTERVAL_S; a new segment after SEGMENT_MAX_BYTES
+#                                              or SEGMENT_MAX_AGE_S
+#   explanations/catalogue-<time>.jsonl        compacted entries (compact_explanations: deduplicated and
+#                                              capped to the newest EXPLANATION_REUSE_MAX_ENTRIES)
+#
+# Every process reads the other writers' entries every EXPLANATION_REUSE_REFRESH_S and keeps at most
+# EXPLANATION_REUSE_MAX_ENTRIES of them (the newest) in memory.
+
+HASH_BITS = 64
+MIN_BOX_SIZE = 16           # smaller crops don't carry enough structure for a perceptual hash
+MIN_CROP_STDDEV = 4.0       # near-uniform crops all hash alike
+GRADIENT_MARGIN = 2         # neighbours closer than this count as equal, so flat background doesn't flip bits on noise
+CONTEXT_DIMENSIONS = 256    # cosine similarities of the projected contexts stay within a few hundredths
+
+STORE_PREFIX = "explanations"
+SEGMENT_PREFIX = f"{STORE_PREFIX}/segments/"
+CATALOGUE_PREFIX = f"{STORE_PREFIX}/catalogue-"
+SEGMENT_MAX_BYTES = 1024 ** 2
+SEGMENT_MAX_AGE_S = 3600
+FLUSH_INTERVAL_S = 2.0
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+EXPLANATION_REUSE_ENABLED = os.environ.get("EXPLANATION_REUSE", "1") != "0"
+EXPLANATION_REUSE_MAX_DISTANCE = int(os.environ.get("EXPLANATION_REUSE_MAX_DISTANCE", "6"))
+EXPLANATION_REUSE_TEXT_SIMILARITY = _env_float("EXPLANATION_REUSE_TEXT_SIMILARITY", 0.6)
+# cosine similarity of the context embeddings: reuse as is above the first, rewrite above the second
+EXPLANATION_REUSE_CONTEXT_SAME = _env_float("EXPLANATION_REUSE_CONTEXT_SAME", 0.85)
+EXPLANATION_REUSE_CONTEXT_RELATED = _env_float("EXPLANATION_REUSE_CONTEXT_RELATED", 0.6)
+EXPLANATION_REUSE_MAX_ENTRIES = int(os.environ.get("EXPLANATION_REUSE_MAX_ENTRIES", "20000"))
+EXPLANATION_REUSE_REFRESH_S = _env_float("EXPLANATION_REUSE_REFRESH_S", 10)
+
+
+def difference_hash(image: "Image.Image") -> Optional[int]:
+    """
+    64-bit dHash: brightness gradients of a 9x8 grayscale thumbnail. None for crops that are
+    too small or too uniform to tell apart.
+    """
+    from PIL import Image, ImageStat
+
+    if image.width < MIN_BOX_SIZE or image.height < MIN_BOX_SIZE:
+        return None
+    gray = image.convert("L")
+    if ImageStat.Stat(gray).stddev[0] < MIN_CROP_STDDEV:
+        return None
+
+    pixels = list(gray.resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1] + GRADIENT_MARGIN)
+    return value
+
+
+def normalize_text(text: Optional[str]) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def text_similarity(a: str, b: str) -> float:
+    # Jaccard similarity of the word sets
+    words_a, words_b = set(a.split()), set(b.split())
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+_projections: Dict[int, "np.ndarray"] = {}
+
+
+def project_context(embedding) -> Optional["np.ndarray"]:
+    # fixed seed: every process projects the same way
+    import numpy as np
+    if embedding is None:
+        return None
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if embedding.shape[0] > CONTEXT_DIMENSIONS:
+        dimensions = embedding.shape[0]
+        if dimensions not in _projections:
+            _projections[dimensions] = np.random.default_rng(0).standard_normal((dimensions, CONTEXT_DIMENSIONS), dtype=np.float32)
+        embedding = embedding @ _projections[dimensions]
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else None
+
+
+def _encode_embedding(embedding) -> Optional[str]:
+    import numpy as np
+    if embedding is None:
+        return None
+    return base64.b64encode(np.asarray(embedding, dtype=np.float16).tobytes()).decode("ascii")
+
+
+def _decode_embedding(data: Optional[str]):
+    import numpy as np
+    if not data:
+        return None
+    return np.frombuffer(base64.b64decode(data), dtype=np.float16).astype(np.float32)
+
+
+def _parse_lines(data: bytes) -> List[Dict]:
+    entries = []
+    for line in data.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+class Fingerprint:
+    def __init__(self, kind: str, image_hash: Optional[int], text: str, context=None):
+        self.kind = kind                        # "visual" or "text"
+        self.image_hash = image_hash
+        self.text = text                        # normalized OCR text
+        self.context = project_context(context) # normalized, projected transcript context, or None
+
+    @property
+    def usable(self) -> bool:
+        return self.image_hash is not None if self.kind == "visual" else bool(self.text)
+
+
+class ReuseMatch:
+    def __init__(self, entry: Dict, mode: str, distance: int, context_similarity: Optional[float]):
+        self.entry = entry
+        self.mode = mode                    # "same": return as is, "adapt": rewrite for the new context
+        self.distance = distance
+        self.context_similarity = context_similarity
+
+    @property
+    def explanation(self) -> str:
+        return self.entry["explanation"]
+
+
+class ExplanationIndex:
+    """
+    In-memory fingerprint index over the entries in the storage. lookup() and add() block (storage I/O),
+    call them from a worker thread.
+    """
+
+    def __init__(
+        self,
+        storage,
+        max_distance: int = EXPLANATION_REUSE_MAX_DISTANCE,
+        text_similarity_threshold: float = EXPLANATION_REUSE_TEXT_SIMILARITY,
+        context_same: float = EXPLANATION_REUSE_CONTEXT_SAME,
+        context_related: float = EXPLANATION_REUSE_CONTEXT_RELATED,
+        max_entries: int = EXPLANATION_REUSE_MAX_ENTRIES,
+        refresh_s: float = EXPLANATION_REUSE_REFRESH_S,
+    ):
+        self.storage = storage
+        self.max_distance = max_distance
+        self.text_similarity_threshold = text_similarity_threshold
+        self.context_same = context_same
+        self.context_related = context_related
+        self.max_entries = max_entries
+        self.refresh_s = refresh_s
+
+        # the 64 bits split as evenly as possible, so no band is short enough to collect most of the entries
+        self.band_count = max_distance + 1
+        self._band_starts = [band * HASH_BITS // self.band_count for band in range(self.band_count + 1)]
+
+        self._lock = threading.Lock()
+        self._entries: List[Dict] = []
+        self._ids = set()
+        self._bands: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._by_text: Dict[str, List[int]] = defaultdict(list)
+        self._lookup_seconds: List[float] = []
+        self._counters = {"lookups": 0, "same": 0, "adapt": 0, "misses": 0, "added": 0, "trimmed": 0, "flush_errors": 0}
+
+        # other writers' entries read so far
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = float("-inf")
+        self._segment_offsets: Dict[str, int] = {}
+        self._loaded_catalogues = set()
+
+        # this process' segment
+        self._writer_id = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+        self._segment_lock = threading.Lock()
+        self._segment_dir = tempfile.mkdtemp(prefix="explanations-")
+        self._segment_number = 0
+        self._segment_started = 0.0
+        self._segment_dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        self._sequence = 0
+        atexit.register(self.flush)
+
+    def _bands_of(self, image_hash: int):
+        starts = self._band_starts
+        return [
+            (band, (image_hash >> starts[band]) & ((1 << (starts[band + 1] - starts[band])) - 1))
+            for band in range(self.band_count)
+        ]
+
+    def _insert(self, entry: Dict):
+        # called with the lock held
+        if entry.get("id") in self._ids:
+            return
+        entry_id = len(self._entries)
+        if "_context" not in entry:
+            entry["_context"] = _decode_embedding(entry.get("context"))
+        self._entries.append(entry)
+        self._ids.add(entry.get("id"))
+        if entry["kind"] == "visual":
+            for band in self._bands_of(entry["hash"]):
+                self._bands[band].append(entry_id)
+        else:
+            self._by_text[entry["text"]].append(entry_id)
+
+    def _trim(self):
+        # keeps the newest max_entries; rebuilding the buckets is cheap next to how rarely it is needed
+        if len(self._entries) <= self.max_entries * 1.1:
+            return
+        entries = sorted(self._entries, key=lambda entry: entry.get("created_at", 0))[-self.max_entries:]
+        self._counters["trimmed"] += len(self._entries) - len(entries)
+        self._entries, self._ids, self._bands, self._by_text = [], set(), defaultdict(list), defaultdict(list)
+        for entry in entries:
+            self._insert(entry)
+
+    def _insert_all(self, entries: List[Dict]):
+        with self._lock:
+            for entry in entries:
+                try:
+                    self._insert(entry)
+                except KeyError:
+                    continue
+            self._trim()
+
+    def _refresh(self):
+        # entries of other writers since the last refresh; at most every refresh_s, one thread at a time
+        if time.monotonic() - self._last_refresh < self.refresh_s or not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_refresh = time.monotonic()
+            listed = self.storage.list(STORE_PREFIX + "/")
+            own_writer = SEGMENT_PREFIX + self._writer_id
+            for key, size in listed:
+                try:
+                    if key.startswith(CATALOGUE_PREFIX) and key not in self._loaded_catalogues:
+                        self._insert_all(_parse_lines(self.storage.read_bytes(key)))
+                        self._loaded_catalogues.add(key)
+                    elif key.startswith(SEGMENT_PREFIX) and key.rsplit("-", 1)[0] != own_writer:
+                        offset = self._segment_offsets.get(key, 0)
+                        if size > offset:
+                            data = self.storage.read_range(key, offset, size - offset)
+                            complete = data[:data.rfind(b"\n") + 1]     # a line still being uploaded is read next time
+                            self._insert_all(_parse_lines(complete))
+                            self._segment_offsets[key] = offset + len(complete)
+                except FileNotFoundError:
+                    continue        # compacted meanwhile; its entries are in a new catalogue
+            listed_keys = {key for key, _ in listed}
+            for key in list(self._segment_offsets):
+                if key not in listed_keys:
+                    del self._segment_offsets[key]
+        except Exception as e:
+            print(f"Could not read the explanation store: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def _candidates(self, fingerprint: Fingerprint) -> List[Tuple[int, Dict]]:
+        if fingerprint.kind == "visual":
+            entry_ids = set()
+            for band in self._bands_of(fingerprint.image_hash):
+                entry_ids.update(self._bands.get(band, ()))
+            candidates = []
+            for entry_id in entry_ids:
+                entry = self._entries[entry_id]
+                distance = bin(entry["hash"] ^ fingerprint.image_hash).count("1")
+                if distance > self.max_distance:
+                    continue
+                # the text has to agree as well (same drawing, other numbers); a box without text only
+                # matches boxes without text
+                if text_similarity(entry["text"], fingerprint.text) < self.text_similarity_threshold:
+                    continue
+                candidates.append((distance, entry))
+            return candidates
+        return [(0, self._entries[entry_id]) for entry_id in self._by_text.get(fingerprint.text, ())]
+
+    def _context_similarity(self, entry: Dict, fingerprint: Fingerprint) -> Optional[float]:
+        import numpy as np
+        if entry["_context"] is None or fingerprint.context is None or len(entry["_context"]) != len(fingerprint.context):
+            return None
+        return float(np.dot(entry["_context"], fingerprint.context))
+
+    def lookup(self, fingerprint: Fingerprint, video_name: str, frame: int, box_id: int) -> Optional[ReuseMatch]:
+        self._refresh()
+        start = time.perf_counter()
+        with self._lock:
+            self._counters["lookups"] += 1
+
+            best = None
+            for distance, entry in self._candidates(fingerprint):
+                if entry["video"] == video_name and entry["frame"] == frame and entry["box_id"] == box_id:
+                    best = ReuseMatch(entry, "same", distance, 1.0)
+                    break
+
+                similarity = self._context_similarity(entry, fingerprint)
+                if similarity is None:
+                    # without embeddings only the same lecture counts as a related context
+                    mode = "adapt" if entry["video"] == video_name else None
+                elif similarity >= self.context_same:
+                    mode = "same"
+                elif similarity >= self.context_related:
+                    mode = "adapt"
+                else:
+                    mode = None
+                if mode is None:
+                    continue
+
+                rank = (mode == "same", similarity if similarity is not None else 0.0, -distance)
+                if best is None or rank > (best.mode == "same", best.context_similarity or 0.0, -best.distance):
+                    best = ReuseMatch(entry, mode, distance, similarity)
+
+            self._counters[best.mode if best else "misses"] += 1
+            self._lookup_seconds.append(time.perf_counter() - start)
+            del self._lookup_seconds[:-1000]
+        return best
+
+    def add(self, fingerprint: Fingerprint, video_name: str, frame: int, box_id: int, label: str, explanation: str):
+        with self._segment_lock:
+            self._sequence += 1
+            entry = {
+                "id": f"{self._writer_id}-{self._sequence}",
+                "video": video_name,
+                "frame": frame,
+                "box_id": box_id,
+                "label": label,
+                "kind": fingerprint.kind,
+                "hash": fingerprint.image_hash,
+                "text": fingerprint.text,
+                "context": _encode_embedding(fingerprint.context),
+                "explanation": explanation,
+                "created_at": time.time(),
+            }
+            line = (json.dumps(entry) + "\n").encode("utf-8")
+
+            if os.path.exists(self._segment_path()) and (
+                os.path.getsize(self._segment_path()) + len(line) > SEGMENT_MAX_BYTES
+                or time.monotonic() - self._segment_started > SEGMENT_MAX_AGE_S
+            ):
+                # a closed segment is never written again, so compaction may take it; kept open while
+                # its upload fails
+                self._flush_locked()
+                if not self._segment_dirty:
+                    os.remove(self._segment_path())
+                    self._segment_number += 1
+            if not os.path.exists(self._segment_path()):
+                self._segment_started = time.monotonic()
+            with open(self._segment_path(), "ab") as f:
+                f.write(line)
+            self._segment_dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(FLUSH_INTERVAL_S, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+        self._insert_all([entry])
+        with self._lock:
+            self._counters["added"] += 1
+
+    def _segment_path(self) -> str:
+        return os.path.join(self._segment_dir, f"{self._segment_number}.jsonl")
+
+    def _segment_key(self) -> str:
+        return f"{SEGMENT_PREFIX}{self._writer_id}-{self._segment_number}.jsonl"
+
+    def flush(self):
+        # uploads this process' current segment (whole; segments stay small)
+        with self._segment_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._flush_timer = None
+        if not self._segment_dirty:
+            return
+        try:
+            self.storage.upload_file(self._segment_path(), self._segment_key())
+            self._segment_dirty = False
+        except Exception as e:
+            self._counters["flush_errors"] += 1
+            print(f"Could not upload explanations to {self._segment_key()}: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = sorted(self._lookup_seconds)
+            return dict(
+                self._counters,
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                segments_read=len(self._segment_offsets),
+                catalogues_read=len(self._loaded_catalogues),
+                lookup_ms_p50=round(lookups[len(lookups) // 2] * 1000, 4) if lookups else None,
+                lookup_ms_max=round(lookups[-1] * 1000, 4) if lookups else None,
+            )
+
+
+def compact_explanations(storage, max_entries: int = EXPLANATION_REUSE_MAX_ENTRIES, min_segment_age_s: float = 2 * SEGMENT_MAX_AGE_S) -> Dict:
+    """
+    Merges the catalogues and the closed segments (older than min_segment_age_s) into one new catalogue:
+    one entry per box and fingerprint (the newest), at most max_entries (the newest). Only the merged
+    files are deleted, so compactions running at the same time lose nothing (they just leave two catalogues).
+    """
+    now_ns = time.time_ns()
+    inputs = []
+    for key, _ in storage.list(STORE_PREFIX + "/"):
+        if key.startswith(CATALOGUE_PREFIX):
+            inputs.append(key)
+        elif key.startswith(SEGMENT_PREFIX):
+            stat = storage.stat(key)
+            if stat is not None and now_ns - stat[1] > min_segment_age_s * 1e9:
+                inputs.append(key)
+    if not inputs:
+        return {"inputs": 0, "entries": 0}
+
+    latest: Dict[tuple, Dict] = {}
+    read_entries = 0
+    for key in inputs:
+        try:
+            entries = _parse_lines(storage.read_bytes(key))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            read_entries += 1
+            box_key = (entry.get("video"), entry.get("frame"), entry.get("box_id"), entry.get("kind"), entry.get("hash"), entry.get("text"))
+            if box_key not in latest or entry.get("created_at", 0) > latest[box_key].get("created_at", 0):
+                latest[box_key] = entry
+    entries = sorted(latest.values(), key=lambda entry: entry.get("created_at", 0))[-max_entries:]
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".jsonl")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for entry in entries:
+                f.write((json.dumps(entry) + "\n").encode("utf-8"))
+        storage.upload_file(tmp_path, f"{CATALOGUE_PREFIX}{now_ns}.jsonl")
+    finally:
+        os.remove(tmp_path)
+    for key in inputs:
+        storage.delete(key)
+    return {"inputs": len(inputs), "read": read_entries, "entries": len(entries)}
+
+
+_index: Optional[ExplanationIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_explanation_index(storage) -> ExplanationIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ExplanationIndex(storage)
+    return _index
+
+
+if __name__ == "__main__":
+    # usage (from the backend directory): python -m services.explanation_cache compact
+    # merges the explanation store of the configured storage; the preprocessing also runs it after each video
+    import sys
+    from services.storage import get_storage
+
+    if sys.argv[1:] != ["compact"]:
+        sys.exit("usage: python -m services.explanation_cache compact")
+    print(compact_explanations(get_storage()))
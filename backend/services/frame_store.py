@@ -0,0 +1,180 @@
+import io
+import json
+import mmap
+import os
+import sys
+import threading
+from typing import Dict, Optional
+
+# Per-video packed frame store: one file with all encoded frames back to back, followed by a json
+# offset index, instead of one loose PNG per slide.
+#
+#   frames/<video>/frames.pack          extracted frames, WebP lossless (exact pixels for the crops)
+#   layouts/<video>/images.pack         layout visualizations, lossy WebP
+#
+#   layout: <frame data ...> <index json> <index offset: 8 bytes little endian> <PACK_MAGIC>
+#   index:  {"codec": "webp", "frames": {"<frame index>": [offset, length]}}
+#
+# Data and index live in one file, so a rewrite is a single os.replace and a reader never pairs the
+# index of one version with the data of another. Readers mmap the file once per process and slice the
+# bytes of a frame out of it.
+
+FRAME_PACK_NAME = "frames.pack"
+LAYOUT_PACK_NAME = "images.pack"
+MEDIA_TYPES = {"webp": "image/webp", "png": "image/png"}
+SUPPORTED_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+PACK_MAGIC = b"FRAMEPK1"
+TRAILER_SIZE = 8 + len(PACK_MAGIC)
+
+
+def _frame_index_from_filename(filename: str) -> Optional[int]:
+    # "<frame index>_frame.png"
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() not in SUPPORTED_EXTENSIONS or not stem.endswith("_frame"):
+        return None
+    try:
+        return int(stem[:-len("_frame")])
+    except ValueError:
+        return None
+
+
+def write_frame_pack(image_dir: str, pack_path: str, lossless: bool = True, quality: int = 80) -> Dict:
+    """
+    Encodes every "<index>_frame.png" in image_dir as WebP and writes them, followed by their index,
+    into pack_path. Returns the index.
+    """
+    from PIL import Image
+
+    frames = {}
+    tmp_pack_path = pack_path + ".tmp"
+    with open(tmp_pack_path, "wb") as pack:
+        for filename in sorted(os.listdir(image_dir)):
+            frame_index = _frame_index_from_filename(filename)
+            if frame_index is None:
+                continue
+
+            with Image.open(os.path.join(image_dir, filename)) as img:
+                with io.BytesIO() as output:
+                    img.convert("RGB").save(output, format="WEBP", lossless=lossless, quality=quality, method=6 if lossless else 4)
+                    data = output.getvalue()
+
+            frames[str(frame_index)] = [pack.tell(), len(data)]
+            pack.write(data)
+
+        index = {"codec": "webp", "frames": frames}
+        index_offset = pack.tell()
+        pack.write(json.dumps(index).encode("utf-8"))
+        pack.write(index_offset.to_bytes(8, "little") + PACK_MAGIC)
+
+    os.replace(tmp_pack_path, pack_path)
+    return index
+
+
+def remove_loose_frames(image_dir: str):
+    for filename in os.listdir(image_dir):
+        if _frame_index_from_filename(filename) is not None:
+            os.remove(os.path.join(image_dir, filename))
+    if not os.listdir(image_dir):
+        os.rmdir(image_dir)
+
+
+def _file_version(path: str) -> tuple:
+    # changes whenever the file is replaced
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class FramePack:
+    def __init__(self, pack_path: str):
+        with open(pack_path, "rb") as f:
+            # the version of the file that is actually mapped, even if it is replaced right now
+            st = os.fstat(f.fileno())
+            self.version = (st.st_ino, st.st_mtime_ns, st.st_size)
+            # an empty file can't be mapped
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+
+        if len(self._data) < TRAILER_SIZE or self._data[-len(PACK_MAGIC):] != PACK_MAGIC:
+            raise ValueError(f"Not a frame pack: {pack_path}")
+        index_offset = int.from_bytes(self._data[-TRAILER_SIZE:-len(PACK_MAGIC)], "little")
+        index = json.loads(bytes(self._data[index_offset:len(self._data) - TRAILER_SIZE]))
+        self.codec = index["codec"]
+        self.media_type = MEDIA_TYPES.get(self.codec, "application/octet-stream")
+        self.frames = {int(key): value for key, value in index["frames"].items()}
+
+    def __contains__(self, frame_index: int) -> bool:
+        return frame_index in self.frames
+
+    def get_bytes(self, frame_index: int) -> Optional[memoryview]:
+        entry = self.frames.get(frame_index)
+        if entry is None:
+            return None
+        offset, length = entry
+        return memoryview(self._data)[offset:offset + length]
+
+    def open_image(self, frame_index: int):
+        from PIL import Image
+        data = self.get_bytes(frame_index)
+        if data is None:
+            return None
+        return Image.open(io.BytesIO(data))
+
+
+_open_packs: Dict[str, FramePack] = {}
+_open_lock = threading.Lock()
+
+
+def get_frame_pack(pack_path: str) -> Optional[FramePack]:
+    """
+    Returns the mapped pack, re-opened when the pack was rewritten, or None if there is none.
+    """
+    try:
+        version = _file_version(pack_path)
+    except FileNotFoundError:
+        return None
+
+    pack = _open_packs.get(pack_path)
+    if pack is not None and pack.version == version:
+        return pack
+
+    with _open_lock:
+        pack = _open_packs.get(pack_path)
+        if pack is None or pack.version != version:
+            pack = FramePack(pack_path)
+            _open_packs[pack_path] = pack
+    return pack
+
+
+def migrate_video(data_dir: str, video_name: str, remove_loose: bool = False):
+    """
+    Packs the loose frame and layout visualization images of one video.
+    """
+    targets = [
+        (os.path.join(data_dir, "frames", video_name), FRAME_PACK_NAME, True),
+        (os.path.join(data_dir, "layouts", video_name), LAYOUT_PACK_NAME, False),
+    ]
+    for video_dir, pack_name, lossless in targets:
+        image_dir = os.path.join(video_dir, "images")
+        if not os.path.isdir(image_dir):
+            continue
+
+        pack_path = os.path.join(video_dir, pack_name)
+        loose_bytes = sum(os.path.getsize(os.path.join(image_dir, name)) for name in os.listdir(image_dir))
+        index = write_frame_pack(image_dir, pack_path, lossless=lossless)
+        print(f"{pack_path}: {len(index['frames'])} frames, {loose_bytes / 1e6:.1f} MB -> {os.path.getsize(pack_path) / 1e6:.1f} MB")
+
+        if remove_loose:
+            remove_loose_frames(image_dir)
+
+
+if __name__ == "__main__":
+    # usage (from the backend directory): python -m services.frame_store [--remove-loose] [<video_name> ...]
+    # without video names, every video in data/frames is migrated
+    args = sys.argv[1:]
+    remove_loose = "--remove-loose" in args
+    video_names = [arg for arg in args if arg != "--remove-loose"]
+
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+    if not video_names:
+        video_names = sorted(os.listdir(os.path.join(data_dir, "frames")))
+    for name in video_names:
+        migrate_video(data_dir, name, remove_loose=remove_loose)
@@ -1,19 +1,133 @@
+import functools
+import os
 from pathlib import Path
-from typing import List, Union
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Optional, Union
 
-import numpy as np
 from ..models.GPT_Model import GPTModel
+from .embedding_batcher import EmbeddingBatcher
+from .upstream_scheduler import SharedLimiter, UpstreamScheduler
+from .transcript import count_tokens
+
+if TYPE_CHECKING:
+    import numpy as np
 
 def get_gpt_explanation(transcript: str, cropped_image: Union[str, Path, bytes], full_slide_image: Union[str, Path, bytes]):
     gpt = GPTModel.get_instance()  # instantiate globally or inside your method
     explanation = gpt.explain(transcript=transcript, cropped_image=cropped_image, full_slide_image=full_slide_image)
 
     return explanation
+
+def get_gpt_text_explanation(transcript: str, box_text: str, label: str = "text"):
+    gpt = GPTModel.get_instance()
+    return gpt.explain_text(transcript=transcript, box_text=box_text, label=label)
     
 def get_gpt_embedding(text: str) -> List[List[float]]:
     gpt = GPTModel.get_instance()
     embedding = gpt.get_embeddings([text])[0]
     return embedding
 
-def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
+
+# every OpenAI call of the API goes through one scheduler per worker. The limits are for all workers of the
+# host together: they share them through lock files in UPSTREAM_LIMITER_DIR. Where that isn't possible (no
+# fcntl on Windows) each worker gets 1/WEB_CONCURRENCY of them. With several API hosts, set the limits to
+# each host's share of the OpenAI quota.
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "8"))
+UPSTREAM_TOKENS_PER_MINUTE = int(os.environ.get("UPSTREAM_TOKENS_PER_MINUTE", "30000"))
+UPSTREAM_LIMITER_DIR = os.environ.get("UPSTREAM_LIMITER_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "upstream"))
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+# rough token estimates for the tokens-per-minute governor
+IMAGE_TOKENS = 1100
+COMPLETION_TOKENS = 200
+
+_upstream_scheduler = None
+
+def get_upstream_scheduler() -> UpstreamScheduler:
+    global _upstream_scheduler
+    if _upstream_scheduler is None:
+        try:
+            limiter = SharedLimiter(UPSTREAM_LIMITER_DIR, UPSTREAM_MAX_CONCURRENCY, UPSTREAM_TOKENS_PER_MINUTE)
+        except (RuntimeError, OSError) as e:
+            print(f"Upstream limits not shared between workers, splitting them by WEB_CONCURRENCY={WEB_CONCURRENCY}: {e}")
+            limiter = None
+        if limiter is not None:
+            _upstream_scheduler = UpstreamScheduler(
+                max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+                tokens_per_minute=UPSTREAM_TOKENS_PER_MINUTE,
+                limiter=limiter,
+            )
+        else:
+            _upstream_scheduler = UpstreamScheduler(
+                max_concurrency=max(1, UPSTREAM_MAX_CONCURRENCY // WEB_CONCURRENCY),
+                tokens_per_minute=max(1, UPSTREAM_TOKENS_PER_MINUTE // WEB_CONCURRENCY),
+            )
+    return _upstream_scheduler
+
+async def get_gpt_explanation_async(transcript: str, cropped_image: bytes, full_slide_image: bytes, session: str, key: Optional[str] = None, slot: Optional[str] = "explain", is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+    gpt = GPTModel.get_instance()
+    return await get_upstream_scheduler().submit(
+        functools.partial(gpt.explain, transcript=transcript, cropped_image=cropped_image, full_slide_image=full_slide_image),
+        session=session,
+        key=key,
+        slot=slot,              # a new explain of the same session supersedes the queued one
+        estimated_tokens=count_tokens(transcript) + 2 * IMAGE_TOKENS + COMPLETION_TOKENS,
+        is_disconnected=is_disconnected,
+    )
+
+async def get_gpt_text_explanation_async(transcript: str, box_text: str, label: str, session: str, key: Optional[str] = None, slot: Optional[str] = "explain", is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+    gpt = GPTModel.get_instance()
+    return await get_upstream_scheduler().submit(
+        functools.partial(gpt.explain_text, transcript=transcript, box_text=box_text, label=label),
+        session=session,
+        key=key,
+        slot=slot,
+        estimated_tokens=count_tokens(transcript) + count_tokens(box_text) + COMPLETION_TOKENS,
+        is_disconnected=is_disconnected,
+    )
+
+async def get_gpt_adapted_explanation_async(explanation: str, transcript: str, session: str, key: Optional[str] = None, slot: Optional[str] = "explain", is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+    gpt = GPTModel.get_instance()
+    return await get_upstream_scheduler().submit(
+        functools.partial(gpt.adapt_explanation, explanation=explanation, transcript=transcript),
+        session=session,
+        key=key,
+        slot=slot,
+        estimated_tokens=count_tokens(transcript) + count_tokens(explanation) + COMPLETION_TOKENS,
+        is_disconnected=is_disconnected,
+    )
+
+async def _embed_batch(texts: List[str]) -> List[List[float]]:
+    # a batch mixes texts of many users, so it is scheduled as its own session
+    gpt = GPTModel.get_instance()
+    return await get_upstream_scheduler().submit(
+        functools.partial(gpt.get_embeddings, texts),
+        session="embedding-batches",
+        estimated_tokens=sum(count_tokens(text) for text in texts),
+    )
+
+
+# concurrent /associate calls share one embeddings request per batch window
+EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get("EMBEDDING_BATCH_MAX_SIZE", "64"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_BATCH_MAX_WAIT_MS", "10"))
+
+_embedding_batcher = None
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        _embedding_batcher = EmbeddingBatcher(
+            _embed_batch,
+            max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+        )
+    return _embedding_batcher
+
+async def get_gpt_embedding_async(text: str) -> List[float]:
+    return await get_embedding_batcher().embed(text)
+
+def warm_up_gpt():
+    # creates the OpenAI client (and imports the SDK) ahead of the first request
+    GPTModel.get_instance().client
+
+def cosine_sim(a: "np.ndarray", b: "np.ndarray") -> float:
+    import numpy as np
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
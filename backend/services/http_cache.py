@@ -0,0 +1,85 @@
+import os
+import re
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+# generated assets whose file names change whenever their content does (HLS segments, sprite sheets)
+IMMUTABLE_MAX_AGE = 31536000        # one year
+# files that keep their name across re-preprocessing (playlists)
+SHORT_MAX_AGE = 60
+
+RANGE_CHUNK_SIZE = 1024 * 1024      # ranged reads from object storage are streamed in pieces of this size
+
+
+def _cache_control(max_age: int, immutable: bool) -> str:
+    cache_control = f"public, max-age={max_age}"
+    if immutable:
+        cache_control += ", immutable"
+    return cache_control
+
+
+def cached_file_response(path: str, media_type: str, max_age: int, immutable: bool = False) -> FileResponse:
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": _cache_control(max_age, immutable)})
+
+
+def storage_file_response(storage, key: str, media_type: str, max_age: int, immutable: bool = False) -> FileResponse:
+    # serves the local copy of a storage key (downloaded into the cache first for object storage)
+    try:
+        path = storage.local_path(key)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="File not found")
+    return cached_file_response(path, media_type, max_age, immutable=immutable)
+
+
+def _parse_range(range_header: str, size: int) -> Optional[tuple]:
+    # first range of "bytes=<start>-<end>", "bytes=<start>-" or "bytes=-<suffix length>"; end is inclusive
+    match = re.match(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)", range_header)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def ranged_storage_response(storage, key: str, media_type: str, range_header: Optional[str]) -> Response:
+    """
+    Streams a (large) storage object without downloading it first; answers Range requests with 206
+    and only the requested bytes, so players can seek in videos kept in object storage.
+    """
+    try:
+        stat = storage.stat(key)
+    except ValueError:
+        stat = None
+    if stat is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    size = stat[0]
+
+    headers = {"Accept-Ranges": "bytes"}
+    start, end, status_code = 0, size - 1, 200
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    def body():
+        position = start
+        while position <= end:
+            length = min(RANGE_CHUNK_SIZE, end - position + 1)
+            yield storage.read_range(key, position, length)
+            position += length
+
+    return StreamingResponse(body(), status_code=status_code, media_type=media_type, headers=headers)
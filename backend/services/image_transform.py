@@ -1,7 +1,10 @@
 import io
-from PIL import Image
+from typing import TYPE_CHECKING
 
-def pil_image_to_bytes(image: Image.Image) -> bytes:
+if TYPE_CHECKING:
+    from PIL import Image
+
+def pil_image_to_bytes(image: "Image.Image") -> bytes:
     with io.BytesIO() as output:
         image.save(output, format="PNG")
         return output.getvalue()
\ No newline at end of file
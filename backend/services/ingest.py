@@ -0,0 +1,297 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:         # Windows
+    fcntl = None
+    import msvcrt
+
+# Ingestion of uploaded lectures. POST /videos stores the upload under ingest/uploads/ and hands it to
+# IngestQueue, whose worker threads each run Program_Preprocessing.py as a separate process (the heavy
+# models never load into the API process). The preprocessing reports its progress with IngestStatus:
+#
+#   data/status/<video>.json        (also written to the storage, so every API node can answer /videos/<video>/status)
+#
+# The uploads, the claim locks and the preprocessing logs (with tracebacks) stay in INGEST_DIR, outside the
+# data folder; /data/ does not serve status/ either.
+#
+# Stages publish their output to the storage as soon as they finish, so the video, its frames and its
+# transcript are served while layouts, HLS renditions and the index are still being computed.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREPROCESSING_SCRIPT = os.path.join(BACKEND_DIR, "Program_Preprocessing.py")
+INGEST_DIR = os.getenv("INGEST_DIR", os.path.join(BACKEND_DIR, "ingest"))
+UPLOAD_DIR = os.getenv("INGEST_UPLOAD_DIR", os.path.join(INGEST_DIR, "uploads"))
+LOCK_DIR = os.path.join(INGEST_DIR, "locks")
+LOG_DIR = os.path.join(INGEST_DIR, "logs")
+STATUS_DIR_NAME = "status"
+
+# in processing order; cheap stages that make the lecture usable come first
+STAGES = ["video", "frames", "thumbnails", "transcript", "layouts", "hls", "pack", "index"]
+
+# what the API can serve once a stage is done
+STAGE_RESULTS = {
+    "video": ["video", "metadata"],
+    "frames": ["frames"],
+    "transcript": ["transcript"],
+    "layouts": ["layouts", "explain"],
+    "thumbnails": ["thumbnails"],
+    "hls": ["hls"],
+}
+
+VIDEO_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+def is_valid_video_name(video_name: str) -> bool:
+    return bool(VIDEO_NAME_PATTERN.match(video_name)) and ".." not in video_name
+
+
+def status_key(video_name: str) -> str:
+    return f"{STATUS_DIR_NAME}/{video_name}.json"
+
+
+def _try_lock(path: str) -> Optional[int]:
+    """
+    Exclusive lock on the file, or None if another process (or descriptor) holds it. The OS releases it
+    when the descriptor is closed or the process dies, so a restart never leaves a stale lock behind.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class IngestStatus:
+    """
+    Per-stage progress of one video, rewritten (atomically) on every change.
+    """
+
+    def __init__(self, data_dir: str, video_name: str, storage=None):
+        self.video_name = video_name
+        self.storage = storage
+        self.path = os.path.join(data_dir, STATUS_DIR_NAME, f"{video_name}.json")
+        self._lock = threading.Lock()
+        self.status = self._load() or self._initial()
+
+    def _initial(self) -> Dict:
+        return {
+            "video": self.video_name,
+            "state": "queued",
+            "stage": None,
+            "error": None,
+            "stages": {stage: {"state": "pending", "progress": 0.0, "started_at": None, "finished_at": None} for stage in STAGES},
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        }
+
+    def _load(self) -> Optional[Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self):
+        self.status["updated_at"] = time.time()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.status, f, indent=2)
+        os.replace(tmp_path, self.path)
+        if self.storage is not None:
+            try:
+                self.storage.upload_file(self.path, status_key(self.video_name))
+            except Exception as e:
+                print(f"Could not publish the status of {self.video_name}: {e}")
+
+    def reset(self):
+        with self._lock:
+            self.status = self._initial()
+            self._write()
+
+    def start(self, stage: str):
+        with self._lock:
+            self.status["state"] = "running"
+            self.status["stage"] = stage
+            self.status["stages"][stage].update(state="running", progress=0.0, started_at=time.time(), finished_at=None)
+            self._write()
+
+    def progress(self, stage: str, done: int, total: int):
+        with self._lock:
+            self.status["stages"][stage]["progress"] = round(done / total, 3) if total else 1.0
+            self._write()
+
+    def finish(self, stage: str):
+        with self._lock:
+            self.status["stages"][stage].update(state="done", progress=1.0, finished_at=time.time())
+            if all(self.status["stages"][name]["state"] == "done" for name in STAGES):
+                self.status["state"] = "done"
+                self.status["stage"] = None
+            self._write()
+
+    def fail(self, error: str, stage: Optional[str] = None):
+        with self._lock:
+            if stage is not None:
+                self.status["stages"][stage].update(state="failed", finished_at=time.time())
+            self.status["state"] = "failed"
+            self.status["error"] = error
+            self._write()
+
+    @contextmanager
+    def stage(self, stage: str):
+        # marks the stage running, then done, or failed (the exception is re-raised)
+        self.start(stage)
+        try:
+            yield
+        except Exception as e:
+            self.fail(f"{type(e).__name__}: {e}", stage)
+            raise
+        self.finish(stage)
+
+
+def read_status(storage, video_name: str) -> Optional[Dict]:
+    """
+    The stored status plus "available": the results the API can already serve.
+    """
+    try:
+        status = storage.read_json(status_key(video_name), cached=False)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    available = []
+    for stage, results in STAGE_RESULTS.items():
+        if status["stages"].get(stage, {}).get("state") == "done":
+            available += results
+    status["available"] = available
+    return status
+
+
+class IngestQueue:
+    """
+    Bounded pool of workers that run the preprocessing of uploaded videos in separate processes.
+
+    Every API worker process has its own queue, so a video is claimed (a lock on ingest/locks/<video>.lock)
+    before it is uploaded or resumed; the claim is held until its preprocessing ends and makes sure only
+    one process works on a video at a time.
+    """
+
+    def __init__(self, max_workers: int = 1, data_dir: str = os.path.join(BACKEND_DIR, "data")):
+        self.max_workers = max_workers
+        self.data_dir = data_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, str] = {}      # video name -> "queued" / "running"
+        self._claims: Dict[str, int] = {}       # video name -> descriptor of its lock file
+
+    def claim(self, video_name: str) -> bool:
+        """
+        Takes the video for this process; False if it is already taken here or by another process.
+        """
+        with self._lock:
+            if video_name in self._claims:
+                return False
+            fd = _try_lock(os.path.join(LOCK_DIR, f"{video_name}.lock"))
+            if fd is None:
+                return False
+            self._claims[video_name] = fd
+            return True
+
+    def release(self, video_name: str):
+        with self._lock:
+            fd = self._claims.pop(video_name, None)
+        if fd is not None:
+            os.close(fd)
+
+    def submit(self, video_name: str, video_path: str, storage=None):
+        # the caller has claimed the video; the claim is released when the job ends
+        with self._lock:
+            self._pending[video_name] = "queued"
+        IngestStatus(self.data_dir, video_name, storage).reset()
+        self._executor.submit(self._run, video_name, video_path, storage)
+
+    def _run(self, video_name: str, video_path: str, storage):
+        self._pending[video_name] = "running"
+        log_path = os.path.join(LOG_DIR, f"{video_name}.log")
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            with open(log_path, "w", encoding="utf-8") as log:
+                process = subprocess.run(
+                    [sys.executable, PREPROCESSING_SCRIPT, video_path],
+                    cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT,
+                )
+            status = IngestStatus(self.data_dir, video_name, storage)
+            if process.returncode != 0:
+                # the failed stage is already marked by the preprocessing itself, unless it crashed early
+                if status.status["state"] != "failed":
+                    status.fail(f"preprocessing exited with code {process.returncode}, see {video_name}.log")
+        except Exception as e:
+            IngestStatus(self.data_dir, video_name, storage).fail(f"{type(e).__name__}: {e}")
+        finally:
+            # copied to lecture_videos by the preprocessing; a failed upload is not retried (it is uploaded again)
+            try:
+                os.remove(video_path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._pending.pop(video_name, None)
+            self.release(video_name)
+
+    def resume_pending(self, storage=None) -> List[str]:
+        """
+        Re-queues uploads whose preprocessing never finished (e.g. the API was restarted meanwhile).
+        """
+        resumed = []
+        if not os.path.isdir(UPLOAD_DIR):
+            return resumed
+        for file_name in sorted(os.listdir(UPLOAD_DIR)):
+            video_name, ext = os.path.splitext(file_name)
+            if file_name.endswith(".part"):
+                continue
+            if not self.claim(video_name):
+                continue                    # another worker process resumes it
+            # read after claiming: another worker may have finished it meanwhile
+            status = IngestStatus(self.data_dir, video_name, storage).status
+            if status["state"] in ("queued", "running"):
+                self.submit(video_name, os.path.join(UPLOAD_DIR, file_name), storage)
+                resumed.append(video_name)
+            else:
+                self.release(video_name)
+        return resumed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = dict(self._pending)
+        return {
+            "max_workers": self.max_workers,
+            "running": sorted(name for name, state in pending.items() if state == "running"),
+            "queued": sorted(name for name, state in pending.items() if state == "queued"),
+        }
+
+
+_queue: Optional[IngestQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_ingest_queue() -> IngestQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = IngestQueue(max_workers=int(os.getenv("INGEST_MAX_WORKERS", 1)))
+    return _queue
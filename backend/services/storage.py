@@ -0,0 +1,616 @@
+import json
+import os
+import posixpath
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:         # Windows
+    fcntl = None
+    import msvcrt
+
+# Storage of the preprocessed data (videos, frames, layouts, transcripts, index, ...), addressed by
+# keys relative to the data root, e.g. "frames/<video>/frames.pack". Configured by environment:
+#
+#   STORAGE_BACKEND=local       (default) files under STORAGE_ROOT (default backend/data)
+#   STORAGE_BACKEND=s3          objects in STORAGE_S3_BUCKET under STORAGE_S3_PREFIX; STORAGE_S3_ENDPOINT
+#                               points to S3-compatible stores (MinIO, ...), credentials come from the
+#                               usual AWS_* variables
+#
+# Remote objects are read through a bounded on-disk LRU cache (STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES),
+# so an API node only keeps the lectures that are actually watched. The cached copy keeps the key layout
+# and the remote modification time, which is how it is revalidated (at most every STORAGE_CACHE_TTL_S).
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# next to the data root, not inside it (/data/ serves the data root)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storage_cache")
+DEFAULT_CACHE_MAX_BYTES = 20 * 1024 ** 3
+# eviction frees the cache down to this share of its limit, so the directory scan runs once per many downloads
+CACHE_LOW_WATER = 0.9
+STALE_TMP_S = 3600          # downloads this old were interrupted (no live worker writes a file that long)
+
+
+def normalize_key(key: str) -> str:
+    # rejects keys like "../../main.py" that would leave the data root
+    normalized = posixpath.normpath(key.replace("\\", "/")).lstrip("/")
+    if normalized in ("", ".") or normalized == ".." or normalized.startswith("../"):
+        raise ValueError(f"Invalid storage key: {key}")
+    return normalized
+
+
+class Storage(ABC):
+    # stat() returns (size in bytes, modification time in ns) or None if the key doesn't exist
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[Tuple[int, int]]:
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str) -> List[Tuple[str, int]]:
+        ...
+
+    @abstractmethod
+    def read_bytes(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        ...
+
+    @abstractmethod
+    def download(self, key: str, dest_path: str):
+        ...
+
+    @abstractmethod
+    def upload_file(self, local_path: str, key: str):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def local_path(self, key: str) -> str:
+        """
+        Path of a local file with the content of the key (raises FileNotFoundError). Needed by
+        everything that memory-maps or streams files.
+        """
+
+    def cached_path(self, key: str) -> Optional[str]:
+        # local file if it is available without a download
+        return None
+
+    def read_json(self, key: str, cached: bool = True):
+        # cached=False: bypass any local cache, for small files that change while being read (status)
+        return json.loads(self.read_bytes(key))
+
+    def prefetch(self, prefixes: Iterable[str]):
+        pass
+
+    def cache_in_background(self, key: str):
+        pass
+
+    def sync_tree(self, local_dir: str, prefix: str):
+        """
+        Uploads every file of local_dir under prefix and deletes the keys under prefix that no longer
+        exist locally. "CURRENT" pointer files are uploaded last, so readers never see a generation
+        whose files are still missing.
+        """
+        prefix = normalize_key(prefix)
+        local_keys = []
+        for dir_path, _, file_names in os.walk(local_dir):
+            for file_name in file_names:
+                if file_name.endswith(".tmp"):
+                    continue
+                relative = os.path.relpath(os.path.join(dir_path, file_name), local_dir).replace(os.sep, "/")
+                local_keys.append(f"{prefix}/{relative}")
+
+        for key in sorted(local_keys, key=lambda key: (posixpath.basename(key) == "CURRENT", key)):
+            self.upload_file(os.path.join(local_dir, *key[len(prefix) + 1:].split("/")), key)
+
+        local_key_set = set(local_keys)
+        for key, _ in self.list(prefix + "/"):
+            if key not in local_key_set:
+                self.delete(key)
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str = DEFAULT_ROOT):
+        self.root = os.path.realpath(root)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *normalize_key(key).split("/"))
+
+    def stat(self, key: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def list(self, prefix: str) -> List[Tuple[str, int]]:
+        base = self._path(prefix.rstrip("/"))
+        if not os.path.isdir(base):
+            return []
+        result = []
+        for dir_path, _, file_names in os.walk(base):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                result.append((os.path.relpath(path, self.root).replace(os.sep, "/"), os.path.getsize(path)))
+        return sorted(result)
+
+    def read_bytes(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+    def download(self, key: str, dest_path: str):
+        shutil.copyfile(self._path(key), dest_path)
+
+    def upload_file(self, local_path: str, key: str):
+        path = self._path(key)
+        if os.path.exists(path) and os.path.samefile(local_path, path):
+            return      # preprocessing wrote directly into the data root
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> str:
+        path = self._path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return path
+
+    def cached_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, region_name: Optional[str] = None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 is only needed on nodes that use the object store
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+                    self._client = boto3.client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region_name,
+                        config=Config(max_pool_connections=32, retries={"max_attempts": 5, "mode": "adaptive"}),
+                    )
+        return self._client
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + normalize_key(key)
+
+    def stat(self, key: str) -> Optional[Tuple[int, int]]:
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["ContentLength"], int(head["LastModified"].timestamp() * 1e9)
+
+    def list(self, prefix: str) -> List[Tuple[str, int]]:
+        object_prefix = self.prefix + normalize_key(prefix) + ("/" if prefix.endswith("/") else "")
+        result = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=object_prefix):
+            for item in page.get("Contents", []):
+                result.append((item["Key"][len(self.prefix):], item["Size"]))
+        return result
+
+    def _get(self, key: str, **kwargs) -> bytes:
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key)
+            raise
+        return response["Body"].read()
+
+    def read_bytes(self, key: str) -> bytes:
+        return self._get(key)
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        return self._get(key, Range=f"bytes={start}-{start + length - 1}")
+
+    def download(self, key: str, dest_path: str):
+        # multipart download with parallel ranged GETs for large objects
+        self.client.download_file(self.bucket, self._object_key(key), dest_path)
+
+    def upload_file(self, local_path: str, key: str):
+        self.client.upload_file(local_path, self.bucket, self._object_key(key))
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def local_path(self, key: str) -> str:
+        raise FileNotFoundError(f"{key}: object storage needs a CachedStorage for local files")
+
+
+class CachedStorage(Storage):
+    """
+    Read-through LRU cache on local disk in front of a remote storage.
+
+    Several worker processes share the cache directory, so its accounting lives there too: the last use
+    of a file is its access time (set on every use; the modification time is the remote version), the
+    total size is kept in .usage, and eviction runs under the .lock file lock over a scan of the directory.
+    Downloads are written to a temporary file and renamed; evicting a file that another process has open
+    or memory-mapped is harmless on POSIX (and skipped where the OS refuses it).
+    """
+
+    LOCK_FILE = ".lock"
+    USAGE_FILE = ".usage"
+
+    def __init__(self, remote: Storage, cache_dir: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES, ttl_s: float = 30.0, prefetch_workers: int = 8,
+                 low_water: float = CACHE_LOW_WATER):
+        self.remote = remote
+        self.cache_dir = os.path.realpath(cache_dir)
+        self.max_bytes = max_bytes
+        self.low_water_bytes = int(max_bytes * low_water)
+        self.ttl_s = ttl_s
+        self.prefetch_workers = prefetch_workers
+
+        self._lock = threading.Lock()
+        self._validated: Dict[str, float] = {}      # key -> last revalidation by this process
+        self._inflight: Dict[str, Future] = {}
+        self._prefetched = set()
+        self._stats: Dict[str, Tuple[Optional[Tuple[int, int]], float]] = {}  # remote stat per key, for the TTL
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._counters = {"hits": 0, "misses": 0, "revalidated": 0, "evicted": 0, "prefetched": 0}
+
+        # files of an earlier run are kept, but revalidated on first use
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._shared_lock():
+            self._scan_and_evict(remove_stale_tmp=True)
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    @contextmanager
+    def _shared_lock(self):
+        # serializes the accounting of all processes that use the cache directory
+        fd = os.open(os.path.join(self.cache_dir, self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            yield
+        finally:
+            os.close(fd)            # releases the lock
+
+    def _read_usage(self) -> int:
+        try:
+            with open(os.path.join(self.cache_dir, self.USAGE_FILE), "r", encoding="ascii") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_usage(self, used_bytes: int):
+        path = os.path.join(self.cache_dir, self.USAGE_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="ascii") as f:
+            f.write(str(max(0, used_bytes)))
+        os.replace(tmp_path, path)         # readers without the lock (cache_stats) never see a partial file
+
+    def _add_usage(self, delta: int, keep: Optional[str] = None):
+        with self._shared_lock():
+            used_bytes = self._read_usage() + delta
+            if used_bytes > self.max_bytes:
+                self._scan_and_evict(keep=keep)
+            else:
+                self._write_usage(used_bytes)
+
+    def _scan_and_evict(self, keep: Optional[str] = None, remove_stale_tmp: bool = False):
+        """
+        Recomputes the usage from the directory and, if it exceeds the limit, removes the least recently
+        used files until it is down to the low-water mark. Called with the shared lock held.
+        """
+        files = []
+        now = time.time()
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if file_name.endswith(".tmp"):
+                    # downloads in progress in other processes are left alone
+                    if remove_stale_tmp and now - st.st_mtime > STALE_TMP_S:
+                        os.remove(path)
+                    continue
+                if dir_path == self.cache_dir and file_name in (self.LOCK_FILE, self.USAGE_FILE):
+                    continue
+                files.append((st.st_atime_ns, os.path.relpath(path, self.cache_dir).replace(os.sep, "/"), st.st_size))
+
+        used_bytes = sum(size for _, _, size in files)
+        target_bytes = self.low_water_bytes if used_bytes > self.max_bytes else used_bytes
+        for _, key, size in sorted(files):
+            if used_bytes <= target_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._cache_path(key))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue            # open in another process (Windows)
+            used_bytes -= size
+            self._counters["evicted"] += 1
+            with self._lock:
+                self._validated.pop(key, None)
+        self._write_usage(used_bytes)
+
+    def _touch(self, path: str):
+        # marks the use for the LRU order without changing the modification time (the remote version)
+        try:
+            st = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="storage-prefetch")
+        return self._executor
+
+    def _fresh_path(self, key: str) -> Optional[str]:
+        with self._lock:
+            validated = self._validated.get(key)
+        if validated is None or time.monotonic() - validated > self.ttl_s:
+            return None
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            return None             # evicted by another process
+        self._touch(path)
+        return path
+
+    def stat(self, key: str) -> Optional[Tuple[int, int]]:
+        key = normalize_key(key)
+        cached = self._stats.get(key)
+        if cached is not None and time.monotonic() - cached[1] <= self.ttl_s:
+            return cached[0]
+        result = self.remote.stat(key)
+        self._stats[key] = (result, time.monotonic())
+        return result
+
+    def list(self, prefix: str) -> List[Tuple[str, int]]:
+        return self.remote.list(prefix)
+
+    def local_path(self, key: str) -> str:
+        key = normalize_key(key)
+        path = self._fresh_path(key)
+        if path is not None:
+            self._counters["hits"] += 1
+            return path
+
+        # one download per key, concurrent readers wait for it
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if owner:
+            try:
+                future.set_result(self._fetch(key))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+        return future.result()
+
+    def _fetch(self, key: str) -> str:
+        remote_stat = self.remote.stat(key)
+        self._stats[key] = (remote_stat, time.monotonic())
+        path = self._cache_path(key)
+        if remote_stat is None:
+            self._drop(key)
+            raise FileNotFoundError(key)
+        size, mtime_ns = remote_stat
+
+        try:
+            st = os.stat(path)
+            previous_size = st.st_size
+            unchanged = st.st_size == size and st.st_mtime_ns == mtime_ns
+        except FileNotFoundError:
+            previous_size = 0
+            unchanged = False
+
+        if unchanged:
+            self._counters["revalidated"] += 1
+            self._touch(path)
+        else:
+            self._counters["misses"] += 1
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                self.remote.download(key, tmp_path)
+                # the remote modification time marks the version of the cached copy, the access time its last use
+                os.utime(tmp_path, ns=(time.time_ns(), mtime_ns))
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._add_usage(size - previous_size, keep=key)
+
+        with self._lock:
+            self._validated[key] = time.monotonic()
+        return path
+
+    def _drop(self, key: str):
+        with self._lock:
+            self._validated.pop(key, None)
+        path = self._cache_path(key)
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError:
+            return                  # open in another process (Windows); replaced on the next download
+        self._add_usage(-size)
+
+    def cached_path(self, key: str) -> Optional[str]:
+        return self._fresh_path(normalize_key(key))
+
+    def read_bytes(self, key: str) -> bytes:
+        with open(self.local_path(key), "rb") as f:
+            return f.read()
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        path = self.cached_path(key)
+        if path is None:
+            return self.remote.read_range(normalize_key(key), start, length)
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+    def read_json(self, key: str, cached: bool = True):
+        if cached:
+            return super().read_json(key)
+        return json.loads(self.remote.read_bytes(normalize_key(key)))
+
+    def download(self, key: str, dest_path: str):
+        shutil.copyfile(self.local_path(key), dest_path)
+
+    def upload_file(self, local_path: str, key: str):
+        key = normalize_key(key)
+        self.remote.upload_file(local_path, key)
+        self._drop(key)
+        self._stats.pop(key, None)
+
+    def delete(self, key: str):
+        key = normalize_key(key)
+        self.remote.delete(key)
+        self._drop(key)
+        self._stats.pop(key, None)
+
+    def prefetch(self, prefixes: Iterable[str]):
+        """
+        Downloads every object under the prefixes in parallel, in the background. Each prefix is
+        prefetched once per process.
+        """
+        with self._lock:
+            new_prefixes = [prefix for prefix in prefixes if prefix not in self._prefetched]
+            self._prefetched.update(new_prefixes)
+        for prefix in new_prefixes:
+            self._get_executor().submit(self._prefetch_prefix, prefix)
+
+    def _prefetch_prefix(self, prefix: str):
+        try:
+            keys = [key for key, size in self.remote.list(prefix) if size <= self.max_bytes // 8]
+        except Exception as e:
+            print(f"Prefetch of {prefix} failed: {e}")
+            with self._lock:
+                self._prefetched.discard(prefix)
+            return
+        for key in keys:
+            self.cache_in_background(key)
+
+    def cache_in_background(self, key: str):
+        key = normalize_key(key)
+        if self._fresh_path(key) is not None or key in self._inflight:
+            return
+
+        def fetch():
+            try:
+                self.local_path(key)
+                self._counters["prefetched"] += 1
+            except Exception as e:
+                print(f"Prefetch of {key} failed: {e}")
+
+        self._get_executor().submit(fetch)
+
+    def cache_stats(self) -> Dict:
+        # counters of this process; the usage is the one of the shared cache directory
+        with self._lock:
+            validated = len(self._validated)
+        return dict(self._counters, validated_keys=validated, used_bytes=self._read_usage(), max_bytes=self.max_bytes)
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def create_storage_from_env() -> Storage:
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalStorage(os.getenv("STORAGE_ROOT", DEFAULT_ROOT))
+    if backend == "s3":
+        bucket = os.getenv("STORAGE_S3_BUCKET")
+        if not bucket:
+            raise ValueError("STORAGE_S3_BUCKET must be set for STORAGE_BACKEND=s3")
+        remote = S3Storage(
+            bucket,
+            prefix=os.getenv("STORAGE_S3_PREFIX", ""),
+            endpoint_url=os.getenv("STORAGE_S3_ENDPOINT"),
+            region_name=os.getenv("STORAGE_S3_REGION"),
+        )
+        return CachedStorage(
+            remote,
+            cache_dir=os.getenv("STORAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_bytes=int(os.getenv("STORAGE_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+            ttl_s=float(os.getenv("STORAGE_CACHE_TTL_S", 30)),
+            prefetch_workers=int(os.getenv("STORAGE_PREFETCH_WORKERS", 8)),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage_from_env()
+    return _storage
+
+
+if __name__ == "__main__":
+    # usage (from the backend directory): python -m services.storage <video_name> [<video_name> ...]
+    # uploads the local preprocessing output of the videos to the configured storage
+    import sys
+    storage = get_storage()
+    for name in sys.argv[1:]:
+        for folder in ("lecture_videos", "hls", "thumbnails", "transcripts", "frames", "layouts", "index"):
+            local_dir = os.path.join(DEFAULT_ROOT, folder, name)
+            if os.path.isdir(local_dir):
+                storage.sync_tree(local_dir, f"{folder}/{name}")
+                print(f"{folder}/{name}: synced")
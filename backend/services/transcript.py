@@ -1,27 +1,134 @@
 import json
+import logging
 import os
-from typing import List, Dict
+import re
+import threading
+import time
+from typing import List, Dict, Optional
 
-# get the current transcript chunk, the five previous ones, and the 5 next ones
-def get_transcript_chunks_for_pause(chunks_path: str, timestamp: float) -> List[Dict]:
-    """
-    Returns up to 9 chunks: 4 before, the current, and 4 after the chunk containing the timestamp.
+# hard cap for the transcript part of the /explain prompt (gpt-4o tokens)
+DEFAULT_TRANSCRIPT_TOKEN_BUDGET = 800
+# chunks considered around the one containing the timestamp: 4 before and 4 after
+CONTEXT_WINDOW = 4
+# how much a chunk's word overlap with the selected box (0..1) counts against its temporal distance
+RELEVANCE_WEIGHT = 2.0
+
+# seconds until loading the tokenizer is tried again after a failure (e.g. its BPE file could not be downloaded)
+TOKENIZER_RETRY_S = 300
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_retry_at = 0.0
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    # tiktoken is imported (and its BPE file loaded) on first use only; while it is unavailable, token
+    # counts are estimated and loading is retried every TOKENIZER_RETRY_S by one thread at a time
+    global _encoding, _encoding_retry_at
+    if _encoding is not None or time.monotonic() < _encoding_retry_at:
+        return _encoding
+    if not _encoding_lock.acquire(blocking=False):
+        return None
+    try:
+        if _encoding is None:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")       # gpt-4o tokenizer
+    except Exception as e:
+        _encoding_retry_at = time.monotonic() + TOKENIZER_RETRY_S
+        logger.warning("Tokenizer unavailable, estimating token counts for %ss: %s", TOKENIZER_RETRY_S, e)
+    finally:
+        _encoding_lock.release()
+    return _encoding
+
+
+def warm_up_tokenizer():
+    _get_encoding()
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _words(text: str) -> set:
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 2}
+
+
+def _relevance(chunk_text: str, box_words: set) -> float:
+    # share of the box's words that also occur in the chunk
+    if not box_words:
+        return 0.0
+    return len(box_words & _words(chunk_text)) / len(box_words)
+
+
+def build_transcript_context(chunks: List[Dict], timestamp: float, token_budget: int = DEFAULT_TRANSCRIPT_TOKEN_BUDGET, box_text: Optional[str] = None) -> str:
     """
-    with open(chunks_path, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    Builds the transcript context for the chunk containing the timestamp, never exceeding token_budget.
 
-    # Find the index of the current chunk
+    The chunks of the window (current chunk +- CONTEXT_WINDOW) are ranked by temporal distance and,
+    if box_text is given, by word overlap with the selected box. In that order each chunk is added
+    with its full text if it still fits, otherwise with its precomputed summary. The current chunk
+    is always included, truncated if even its summary does not fit. Output is in chronological order.
+    """
     current_index = next(
         (i for i, chunk in enumerate(chunks) if chunk["start"] <= timestamp < chunk["end"]),
         None
     )
 
     if current_index is None:
-        return []
+        return ""
+
+    start_index = max(0, current_index - CONTEXT_WINDOW)
+    end_index = min(len(chunks), current_index + CONTEXT_WINDOW + 1)
+
+    box_words = _words(box_text) if box_text else set()
+    ranked = sorted(
+        range(start_index, end_index),
+        key=lambda i: (i != current_index, abs(i - current_index) - RELEVANCE_WEIGHT * _relevance(chunks[i]["text"], box_words))
+    )
 
-    # Calculate start and end indices, ensuring they stay within bounds
-    start_index = max(0, current_index - 4)
-    end_index = min(len(chunks), current_index + 5)  # +5 to include current + 4 after
+    selected = {}
+    used = 0
+    for i in ranked:
+        candidates = [chunks[i]["text"].strip()]
+        if chunks[i].get("summary"):
+            candidates.append(chunks[i]["summary"].strip())
 
-    return " ".join(chunk["text"] for chunk in chunks[start_index:end_index])
+        for text in candidates:
+            tokens = count_tokens(text) + 1      # +1 for the joining space
+            if used + tokens <= token_budget:
+                selected[i] = text
+                used += tokens
+                break
+
+        if i == current_index and i not in selected:
+            selected[i] = truncate_to_tokens(candidates[-1], token_budget - 1)
+            used = token_budget
+
+    return " ".join(selected[i] for i in sorted(selected))
+
+
+# get the current transcript chunk, the 4 previous ones, and the 4 next ones within the token budget
+def get_transcript_chunks_for_pause(chunks_path: str, timestamp: float, token_budget: int = DEFAULT_TRANSCRIPT_TOKEN_BUDGET, box_text: Optional[str] = None) -> str:
+    """
+    Returns the transcript context for the timestamp: up to 4 chunks before, the current, and 4 after,
+    see build_transcript_context.
+    """
+    with open(chunks_path, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
 
+    return build_transcript_context(chunks, timestamp, token_budget=token_budget, box_text=box_text)
@@ -0,0 +1,366 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+
+try:
+    import fcntl
+except ImportError:         # Windows: no shared limiter, see services/gpt.py
+    fcntl = None
+
+SLOT_POLL_S = 0.05          # how often a dispatcher retries when all shared slots are taken by other workers
+
+
+class RequestCancelled(Exception):
+    """The waiter was superseded by a newer request of its session or its client disconnected."""
+
+
+class _Job:
+    def __init__(self, call: Callable[[], object], session: str, key: Optional[str], priority: int, estimated_tokens: int):
+        self.call = call
+        self.session = session
+        self.key = key
+        self.priority = priority
+        self.estimated_tokens = estimated_tokens
+        self.waiters: Dict[asyncio.Future, str] = {}       # waiter -> its session
+        self.enqueued_at = time.monotonic()
+        self.started = False
+        self.shared_slot: Optional[int] = None
+
+
+class SharedLimiter:
+    """
+    Concurrency and tokens-per-minute limits shared by all worker processes of a host, kept in files in
+    `state_dir`: one lock file per concurrency slot (flock; the OS releases it if a worker dies) and a token
+    bucket file that is updated under its lock.
+    """
+
+    def __init__(self, state_dir: str, max_concurrency: int, tokens_per_minute: int):
+        if fcntl is None:
+            raise RuntimeError("SharedLimiter needs fcntl")
+        os.makedirs(state_dir, exist_ok=True)
+        self.tokens_per_minute = tokens_per_minute
+        self._slot_paths = [os.path.join(state_dir, f"slot-{slot}.lock") for slot in range(max_concurrency)]
+        self._bucket_path = os.path.join(state_dir, "tokens")
+
+    def acquire_slot(self) -> Optional[int]:
+        # file descriptor holding a free slot, or None if all are taken
+        for path in self._slot_paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release_slot(self, fd: int):
+        os.close(fd)            # closing the descriptor releases its lock
+
+    def _update_bucket(self, needed: float) -> tuple:
+        # refills the bucket and takes `needed` tokens if available; returns (taken, tokens left)
+        fd = os.open(self._bucket_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            fields = os.read(fd, 64).split()
+            tokens, updated = (float(fields[0]), float(fields[1])) if len(fields) == 2 else (float(self.tokens_per_minute), now)
+            tokens = min(float(self.tokens_per_minute), tokens + max(0.0, now - updated) * self.tokens_per_minute / 60)
+            taken = tokens >= needed
+            if taken:
+                tokens -= needed
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, f"{tokens} {now}".encode("ascii"))
+            return taken, tokens
+        finally:
+            os.close(fd)
+
+    def take_tokens(self, needed: int) -> float:
+        """
+        Takes the tokens and returns 0, or returns the seconds until enough tokens are available.
+        """
+        taken, tokens = self._update_bucket(needed)
+        return 0.0 if taken else (needed - tokens) * 60 / self.tokens_per_minute
+
+    def available_tokens(self) -> float:
+        return self._update_bucket(0)[1]
+
+
+class UpstreamScheduler:
+    """
+    Central queue for the (blocking) OpenAI calls of the API.
+
+    - every session has its own priority queue (lower priority value first); sessions are served
+      round-robin, so one heavy user can't occupy the whole upstream capacity
+    - at most `max_concurrency` calls run at once and the estimated tokens of started calls stay
+      within `tokens_per_minute` (token bucket); with a SharedLimiter both limits hold for all worker
+      processes together
+    - calls with the same `key` that are queued or running are shared instead of repeated
+    - a new call of a session supersedes its queued call with the same `slot`, and a waiter whose
+      client disconnected gives up; a call nobody waits for anymore is dropped from the queue (a call
+      already running can't be interrupted, its result is discarded)
+    """
+
+    def __init__(self, max_concurrency: int = 8, tokens_per_minute: int = 30000, disconnect_poll_s: float = 0.5, limiter: Optional[SharedLimiter] = None):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.disconnect_poll_s = disconnect_poll_s
+        self.limiter = limiter
+
+        self._queues: Dict[str, List] = {}          # session -> heap of (priority, sequence, job)
+        self._session_order: Deque[str] = deque()   # round-robin order of sessions with queued jobs
+        self._by_key: Dict[str, _Job] = {}          # queued or running jobs by dedup key
+        self._by_slot: Dict[tuple, _Job] = {}       # (session, slot) -> its latest job
+        self._sequence = itertools.count()
+        self._running = 0
+
+        self._tokens = float(tokens_per_minute)
+        self._tokens_updated = time.monotonic()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running_tasks: Set[asyncio.Task] = set()
+
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "deduplicated": 0, "superseded": 0, "disconnected": 0, "dropped": 0}
+
+    async def submit(
+        self,
+        call: Callable[[], object],
+        session: str,
+        key: Optional[str] = None,
+        slot: Optional[str] = None,
+        priority: int = 0,
+        estimated_tokens: int = 1000,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ):
+        """
+        Queues `call` (run in a worker thread) and returns its result.
+        Raises RequestCancelled when superseded or when `is_disconnected()` becomes true.
+        """
+        self._ensure_dispatcher()
+        self._counters["submitted"] += 1
+
+        job = self._by_key.get(key) if key is not None else None
+        if job is not None:
+            self._counters["deduplicated"] += 1
+        else:
+            job = _Job(call, session, key, priority, estimated_tokens)
+            self._enqueue(job)
+
+        if slot is not None:
+            previous = self._by_slot.get((session, slot))
+            if previous is not None and previous is not job:
+                self._supersede(previous, session)
+            self._by_slot[(session, slot)] = job
+
+        waiter = asyncio.get_running_loop().create_future()
+        job.waiters[waiter] = session
+
+        try:
+            while True:
+                timeout = self.disconnect_poll_s if is_disconnected is not None else None
+                done, _ = await asyncio.wait({waiter}, timeout=timeout)
+                if done:
+                    return waiter.result()
+                if await is_disconnected():
+                    self._counters["disconnected"] += 1
+                    raise RequestCancelled("client disconnected")
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            self._release_waiter(job, waiter)
+            if slot is not None and self._by_slot.get((session, slot)) is job and not job.waiters:
+                del self._by_slot[(session, slot)]
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch_loop())
+
+    def _enqueue(self, job: _Job):
+        if job.session not in self._queues:
+            self._queues[job.session] = []
+            self._session_order.append(job.session)
+        heapq.heappush(self._queues[job.session], (job.priority, next(self._sequence), job))
+        if job.key is not None:
+            self._by_key[job.key] = job
+        self._wakeup.set()
+
+    def _supersede(self, job: _Job, session: str):
+        # only this session's waiters are cancelled; deduplicated waiters of other sessions keep the job
+        for waiter, waiter_session in list(job.waiters.items()):
+            if waiter_session == session and not waiter.done():
+                waiter.set_exception(RequestCancelled("superseded by a newer request"))
+                self._counters["superseded"] += 1
+
+    def _release_waiter(self, job: _Job, waiter: asyncio.Future):
+        job.waiters.pop(waiter, None)
+        if not job.waiters and not job.started:
+            # nobody waits for the queued call anymore: skipped by the dispatcher
+            self._counters["dropped"] += 1
+            if job.key is not None and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            self._wakeup.set()
+
+    def _refill_tokens(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.tokens_per_minute), self._tokens + (now - self._tokens_updated) * self.tokens_per_minute / 60)
+        self._tokens_updated = now
+
+    def _next_job(self) -> Optional[_Job]:
+        # round-robin over sessions, highest priority job of the session first
+        for _ in range(len(self._session_order)):
+            session = self._session_order.popleft()
+            queue = self._queues[session]
+            while queue and not queue[0][2].waiters:
+                heapq.heappop(queue)                # abandoned
+            if not queue:
+                del self._queues[session]
+                continue
+            job = heapq.heappop(queue)[2]
+            if queue:
+                self._session_order.append(session)
+            else:
+                del self._queues[session]
+            return job
+        return None
+
+    async def _reserve(self, needed: int) -> tuple:
+        """
+        Takes the tokens (and a shared slot) for the next call. Returns (0, slot) on success, otherwise
+        (seconds to wait, None). The shared limiter locks and reads files, so it runs in a worker thread.
+        """
+        if self.limiter is None:
+            self._refill_tokens()
+            if self._tokens < needed:
+                return (needed - self._tokens) * 60 / self.tokens_per_minute, None
+            self._tokens -= needed
+            return 0, None
+
+        shared_slot = await asyncio.to_thread(self.limiter.acquire_slot)
+        if shared_slot is None:
+            return SLOT_POLL_S, None
+        try:
+            wait_s = await asyncio.to_thread(self.limiter.take_tokens, needed)
+        except BaseException:
+            self.limiter.release_slot(shared_slot)
+            raise
+        if wait_s:
+            self.limiter.release_slot(shared_slot)
+            return wait_s, None
+        return 0, shared_slot
+
+    def _peek_tokens_needed(self) -> int:
+        for session in self._session_order:
+            for _, _, job in sorted(self._queues[session]):
+                if job.waiters:
+                    return min(job.estimated_tokens, self.tokens_per_minute)
+        return 0
+
+    async def _dispatch_loop(self):
+        # a failing dispatch (e.g. the shared limiter's state files can't be read) fails the queued calls
+        # instead of leaving their waiters hanging, and dispatching goes on with the next submitted calls
+        while True:
+            try:
+                await self._dispatch()
+            except Exception as e:
+                print(f"Upstream dispatch failed: {e}")
+                self._fail_queued(e)
+                await asyncio.sleep(SLOT_POLL_S)
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            if self._running < self.max_concurrency and self._session_order:
+                needed = self._peek_tokens_needed()
+                shared_slot = None
+                if needed:
+                    wait_s, shared_slot = await self._reserve(needed)
+                    if wait_s:
+                        # wait for the bucket or a slot (or for something else to change)
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), timeout=wait_s)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+
+                # usually the peeked job; the queue may have changed while the shared limiter was asked
+                job = self._next_job()
+                if job is not None:
+                    job.shared_slot = shared_slot
+                    self._start(job)
+                    continue
+                if shared_slot is not None:
+                    self.limiter.release_slot(shared_slot)
+
+            await self._wakeup.wait()
+
+    def _fail_queued(self, error: Exception):
+        for queue in self._queues.values():
+            for _, _, job in queue:
+                if job.waiters:
+                    self._counters["failed"] += 1
+                for waiter in list(job.waiters):
+                    if not waiter.done():
+                        waiter.set_exception(error)
+                if job.key is not None and self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+        self._queues.clear()
+        self._session_order.clear()
+
+    def _start(self, job: _Job):
+        job.started = True
+        self._running += 1
+        self._wait_times.append(time.monotonic() - job.enqueued_at)
+
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._running_tasks.add(task)
+        task.add_done_callback(self._running_tasks.discard)
+
+    async def _run(self, job: _Job):
+        try:
+            result = await asyncio.to_thread(job.call)
+        except Exception as e:
+            self._counters["failed"] += 1
+            for waiter in list(job.waiters):
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            self._counters["completed"] += 1
+            for waiter in list(job.waiters):
+                if not waiter.done():
+                    waiter.set_result(result)
+        finally:
+            self._running -= 1
+            if job.shared_slot is not None:
+                self.limiter.release_slot(job.shared_slot)
+                job.shared_slot = None
+            if job.key is not None and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            self._wakeup.set()
+
+    def stats(self) -> Dict:
+        waits = sorted(self._wait_times)
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else None
+
+        return dict(
+            self._counters,
+            queue_depth=sum(1 for queue in self._queues.values() for _, _, job in queue if job.waiters),
+            queued_sessions=len(self._session_order),
+            running=self._running,
+            tokens_available=round(self.limiter.available_tokens() if self.limiter is not None else self._tokens),
+            shared_limits=self.limiter is not None,
+            wait_s_mean=round(sum(waits) / len(waits), 4) if waits else None,
+            wait_s_p50=percentile(0.5),
+            wait_s_p95=percentile(0.95),
+        )
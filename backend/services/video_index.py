@@ -0,0 +1,233 @@
+import json
+import os
+import shutil
+import sys
+import threading
+from typing import Dict, List, Optional
+
+# Read-only per-video arrays, published once as .npy files under data/index/<video>/gen-<n>/ and
+# opened with mmap_mode="r" by every API worker. All uvicorn worker processes share the same
+# page-cache pages, so memory stays constant when workers are added.
+#
+# data/index/<video>/CURRENT holds the generation number that is currently live. Re-running the
+# preprocessing publishes gen-<n+1> and atomically swaps CURRENT; workers compare the generation on
+# every lookup and re-attach to the new files without a restart.
+
+INDEX_DIR_NAME = "index"
+KEEP_GENERATIONS = 2        # older generations are removed; the previous one stays for workers still attached
+INDEX_FILES = ("chunk_embeddings.npy", "chunk_times.npy", "frame_indices.npy", "boxes.npy", "chunks_meta.json", "boxes_meta.json")
+
+
+def _box_dtype():
+    import numpy as np
+    return np.dtype([
+        ("frame", np.int64),
+        ("box_id", np.int32),
+        ("cls_id", np.int32),
+        ("score", np.float32),
+        ("coordinate", np.float32, (4,)),
+    ])
+
+
+def _video_index_dir(data_dir: str, video_name: str) -> str:
+    return os.path.join(data_dir, INDEX_DIR_NAME, video_name)
+
+
+def read_generation(data_dir: str, video_name: str) -> Optional[int]:
+    current_path = os.path.join(_video_index_dir(data_dir, video_name), "CURRENT")
+    try:
+        with open(current_path, "r") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def publish_video_index(data_dir: str, video_name: str) -> int:
+    """
+    Builds the array files for one video from its chunks.json, frame_indices.json and layout
+    jsons, and makes them the live generation. Returns the new generation number.
+    """
+    import numpy as np
+
+    with open(os.path.join(data_dir, "transcripts", video_name, "chunks.json"), "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    with open(os.path.join(data_dir, "frames", video_name, "frame_indices.json"), "r") as f:
+        frame_indices = sorted(json.load(f))
+
+    # chunk embeddings are normalized once here, so a similarity search is a single matrix-vector product
+    embeddings = np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32)
+    if len(embeddings):
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    chunk_times = np.asarray([[chunk["start"], chunk["end"]] for chunk in chunks], dtype=np.float64).reshape(-1, 2)
+    chunks_meta = [{key: value for key, value in chunk.items() if key != "embedding"} for chunk in chunks]
+
+    box_rows = []
+    boxes_meta = []         # label and OCR text per row of the box table
+    for frame in frame_indices:
+        layout_path = os.path.join(data_dir, "layouts", video_name, "res", f"{frame}_frame.json")
+        if not os.path.isfile(layout_path):
+            continue
+        with open(layout_path, "r") as f:
+            layout = json.load(f)
+        for box in layout.get("boxes", []):
+            box_rows.append((frame, box["box_id"], box["cls_id"], box["score"], box["coordinate"]))
+            meta = {"label": box["label"], "text": box.get("text")}
+            if "member_labels" in box:
+                meta["member_labels"] = box["member_labels"]
+            boxes_meta.append(meta)
+    boxes = np.array(box_rows, dtype=_box_dtype())
+
+    index_dir = _video_index_dir(data_dir, video_name)
+    generation = (read_generation(data_dir, video_name) or 0) + 1
+    gen_dir = os.path.join(index_dir, f"gen-{generation}")
+    tmp_dir = gen_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(gen_dir, ignore_errors=True)     # leftover of an interrupted publish, never live
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "chunk_embeddings.npy"), embeddings)
+    np.save(os.path.join(tmp_dir, "chunk_times.npy"), chunk_times)
+    np.save(os.path.join(tmp_dir, "frame_indices.npy"), np.asarray(frame_indices, dtype=np.int64))
+    np.save(os.path.join(tmp_dir, "boxes.npy"), boxes)
+    with open(os.path.join(tmp_dir, "chunks_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(chunks_meta, f)
+    with open(os.path.join(tmp_dir, "boxes_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(boxes_meta, f)
+
+    os.replace(tmp_dir, gen_dir)
+
+    # swap the live generation atomically
+    current_tmp = os.path.join(index_dir, "CURRENT.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(str(generation))
+    os.replace(current_tmp, os.path.join(index_dir, "CURRENT"))
+
+    for name in os.listdir(index_dir):
+        if name.startswith("gen-") and not name.endswith(".tmp"):
+            try:
+                old_generation = int(name[len("gen-"):])
+            except ValueError:
+                continue
+            if old_generation <= generation - KEEP_GENERATIONS:
+                shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)   # may still be mapped on Windows
+
+    return generation
+
+
+class VideoIndex:
+    def __init__(self, gen_dir: str, generation: int):
+        import numpy as np
+        self.generation = generation
+        self.chunk_embeddings = np.load(os.path.join(gen_dir, "chunk_embeddings.npy"), mmap_mode="r")
+        self.chunk_times = np.load(os.path.join(gen_dir, "chunk_times.npy"), mmap_mode="r")
+        self.frame_indices = np.load(os.path.join(gen_dir, "frame_indices.npy"), mmap_mode="r")
+        self.boxes = np.load(os.path.join(gen_dir, "boxes.npy"), mmap_mode="r")
+
+        # chunk texts and labels without embeddings, box labels and OCR texts; small enough to keep per
+        # process, and read right away: the mapped arrays stay valid when a newer publish removes the
+        # generation directory, files opened later would not
+        with open(os.path.join(gen_dir, "chunks_meta.json"), "r", encoding="utf-8") as f:
+            self.chunks_meta: List[Dict] = json.load(f)
+        with open(os.path.join(gen_dir, "boxes_meta.json"), "r", encoding="utf-8") as f:
+            self.boxes_meta: List[Dict] = json.load(f)
+
+    def frame_for_index(self, frame_index: int) -> Optional[int]:
+        import numpy as np
+        # first extracted frame at or after the given video frame index
+        pos = int(np.searchsorted(self.frame_indices, frame_index, side="left"))
+        if pos >= len(self.frame_indices):
+            return None
+        return int(self.frame_indices[pos])
+
+    def _box_at(self, position: int) -> Dict:
+        # same fields as the box in the layout json: box_id, cls_id, label, score, coordinate, text
+        row = self.boxes[position]
+        return dict(
+            self.boxes_meta[position],
+            box_id=int(row["box_id"]),
+            cls_id=int(row["cls_id"]),
+            score=float(row["score"]),
+            coordinate=row["coordinate"].tolist(),
+        )
+
+    def box(self, frame: int, box_id: int) -> Optional[Dict]:
+        import numpy as np
+        match = np.flatnonzero((self.boxes["frame"] == frame) & (self.boxes["box_id"] == box_id))
+        if not len(match):
+            return None
+        return self._box_at(int(match[0]))
+
+    def frame_boxes(self, frame: int) -> List[Dict]:
+        import numpy as np
+        return [self._box_at(int(position)) for position in np.flatnonzero(self.boxes["frame"] == frame)]
+
+    def box_coordinates(self, frame: int, box_id: int) -> Optional[List[float]]:
+        box = self.box(frame, box_id)
+        return box["coordinate"] if box else None
+
+    def context_embedding(self, timestamp: float):
+        # normalized embedding of the chunk playing at the timestamp
+        import numpy as np
+        pos = int(np.searchsorted(self.chunk_times[:, 0], timestamp, side="right")) - 1
+        if pos < 0:
+            return None
+        return np.asarray(self.chunk_embeddings[pos], dtype=np.float32)
+
+    def most_similar_chunk(self, embedding, max_start: float, exclude_last: int = 0):
+        """
+        Returns (chunk index, cosine similarity) of the chunk most similar to the embedding among the
+        chunks starting at or before max_start, leaving out the last `exclude_last` of them.
+        """
+        import numpy as np
+        past_count = int(np.searchsorted(self.chunk_times[:, 0], max_start, side="right"))
+        candidate_count = past_count - exclude_last
+        if candidate_count <= 0:
+            return None, None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        sims = self.chunk_embeddings[:candidate_count] @ query
+        best = int(np.argmax(sims))
+        return best, float(sims[best])
+
+
+_open_indexes: Dict[str, VideoIndex] = {}
+_open_lock = threading.Lock()
+
+
+def read_live_generation(storage, video_name: str) -> Optional[int]:
+    # same as read_generation, through the storage the API serves from
+    try:
+        return int(storage.read_bytes(f"{INDEX_DIR_NAME}/{video_name}/CURRENT").decode().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def get_video_index(storage, video_name: str) -> Optional[VideoIndex]:
+    """
+    Returns the memory-mapped index of the video's live generation, or None if it was never published.
+    The files of the generation are mapped from the storage's local copy (its cache for object storage).
+    """
+    generation = read_live_generation(storage, video_name)
+    if generation is None:
+        return None
+
+    index = _open_indexes.get(video_name)
+    if index is not None and index.generation == generation:
+        return index
+
+    with _open_lock:
+        index = _open_indexes.get(video_name)
+        if index is None or index.generation != generation:
+            gen_prefix = f"{INDEX_DIR_NAME}/{video_name}/gen-{generation}"
+            paths = [storage.local_path(f"{gen_prefix}/{name}") for name in INDEX_FILES]
+            index = VideoIndex(os.path.dirname(paths[0]), generation)
+            _open_indexes[video_name] = index
+    return index
+
+
+if __name__ == "__main__":
+    # usage (from the backend directory): python -m services.video_index <video_name> [<video_name> ...]
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+    for name in sys.argv[1:]:
+        print(f"{name}: published generation {publish_video_index(data_dir, name)}")
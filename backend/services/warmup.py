@@ -0,0 +1,95 @@
+import importlib
+import subprocess
+import sys
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# heavy modules the request handlers need; they are imported in a background thread after
+# startup instead of at module load, so a fresh worker can answer /health right away
+WARMUP_MODULES = ["numpy", "PIL.Image", "openai"]
+
+# max seconds `import backend.main` may take in a fresh interpreter (checked by `python -m backend.services.warmup`)
+IMPORT_TIME_BUDGET_S = 0.8
+
+# top-level packages that must not be loaded by `import backend.main` (they are imported lazily or by the warm-up)
+DEFERRED_PACKAGES = ["numpy", "PIL", "openai", "tiktoken", "boto3"]
+
+_ready = threading.Event()
+_status = {"state": "starting", "error": None, "seconds": None}
+
+
+def start_warmup(steps: Optional[List[Callable[[], object]]] = None) -> threading.Thread:
+    """
+    Imports WARMUP_MODULES and runs the given warm-up steps (e.g. creating the OpenAI client)
+    in a daemon thread. /ready reports 503 until this has finished.
+    """
+    thread = threading.Thread(target=_run_warmup, args=(steps or [],), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_warmup(steps: List[Callable[[], object]]):
+    _status["state"] = "warming_up"
+    start = time.perf_counter()
+    try:
+        for module in WARMUP_MODULES:
+            importlib.import_module(module)
+        for step in steps:
+            step()
+    except Exception as e:
+        _status["state"] = "failed"
+        _status["error"] = f"{type(e).__name__}: {e}"
+        print(f"Warm-up failed: {_status['error']}")
+        return
+    finally:
+        _status["seconds"] = round(time.perf_counter() - start, 3)
+
+    _status["state"] = "ready"
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def warmup_status() -> Dict:
+    return dict(_status)
+
+
+def import_in_fresh_interpreter(module: str = "backend.main") -> Tuple[float, List[str]]:
+    """
+    Imports the module in a fresh interpreter (from the repository root) and returns the wall-clock
+    import time in seconds and the DEFERRED_PACKAGES it loaded.
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    code = (
+        "import sys, time; start = time.perf_counter(); "
+        f"import {module}; "
+        "seconds = time.perf_counter() - start; "
+        f"print(seconds, *[name for name in {DEFERRED_PACKAGES!r} if name in sys.modules])"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=repo_root, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    fields = result.stdout.strip().splitlines()[-1].split()
+    return float(fields[0]), fields[1:]
+
+
+def measure_import_time(module: str = "backend.main", runs: int = 3) -> float:
+    """
+    Imports the module in `runs` fresh interpreters and returns the fastest import time in seconds.
+    """
+    return min(import_in_fresh_interpreter(module)[0] for _ in range(runs))
+
+
+if __name__ == "__main__":
+    # usage (from the repository root): python -m backend.services.warmup [budget_seconds]
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_TIME_BUDGET_S
+    seconds = measure_import_time()
+    loaded = import_in_fresh_interpreter()[1]
+    print(f"import backend.main: {seconds:.3f}s (budget {budget:.3f}s)")
+    if loaded:
+        print(f"loaded at import: {', '.join(loaded)}")
+    sys.exit(0 if seconds <= budget and not loaded else 1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the API code as the "backend" package, like uvicorn does (uvicorn backend.main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
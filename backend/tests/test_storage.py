@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from backend.services.storage import CachedStorage, S3Storage, Storage
+
+BUCKET = "lectures"
+
+
+@pytest.fixture
+def s3():
+    # in-memory stand-in for S3 (moto), so S3Storage runs against the real boto3 client
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, prefix="data", region_name="us-east-1")
+
+
+def write(path, content: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_s3_storage_round_trip(s3, tmp_path):
+    s3.upload_file(write(str(tmp_path / "a.json"), b'{"fps": 25}'), "lecture_videos/x/metadata.json")
+    s3.upload_file(write(str(tmp_path / "b.bin"), bytes(range(256))), "frames/x/frames.pack")
+
+    assert s3.stat("lecture_videos/x/metadata.json")[0] == 11
+    assert s3.stat("lecture_videos/x/missing.json") is None
+    assert s3.read_json("lecture_videos/x/metadata.json") == {"fps": 25}
+    assert s3.read_range("frames/x/frames.pack", 10, 5) == bytes(range(10, 15))
+    assert [key for key, _ in s3.list("frames/")] == ["frames/x/frames.pack"]
+    with pytest.raises(FileNotFoundError):
+        s3.read_bytes("frames/x/missing.pack")
+    with pytest.raises(ValueError):
+        s3.stat("../outside")
+
+    s3.download("frames/x/frames.pack", str(tmp_path / "download.bin"))
+    assert (tmp_path / "download.bin").read_bytes() == bytes(range(256))
+
+    s3.delete("frames/x/frames.pack")
+    assert s3.stat("frames/x/frames.pack") is None
+
+
+def test_sync_tree_uploads_current_last_and_removes_extras(s3, tmp_path):
+    local_dir = tmp_path / "index"
+    write(str(local_dir / "gen-2" / "boxes.npy"), b"boxes")
+    write(str(local_dir / "CURRENT"), b"2")
+    s3.upload_file(write(str(tmp_path / "old"), b"old"), "index/x/gen-1/boxes.npy")
+
+    s3.sync_tree(str(local_dir), "index/x")
+    assert sorted(key for key, _ in s3.list("index/x/")) == ["index/x/CURRENT", "index/x/gen-2/boxes.npy"]
+
+
+def test_cached_storage_reads_through_and_revalidates(s3, tmp_path):
+    cache = CachedStorage(s3, str(tmp_path / "cache"), max_bytes=1024, ttl_s=0)
+    s3.upload_file(write(str(tmp_path / "v1"), b"version 1"), "transcripts/x/chunks.json")
+
+    path = cache.local_path("transcripts/x/chunks.json")
+    assert open(path, "rb").read() == b"version 1"
+    cache.local_path("transcripts/x/chunks.json")
+    assert cache.cache_stats()["misses"] == 1 and cache.cache_stats()["revalidated"] == 1
+
+    time.sleep(0.01)
+    s3.upload_file(write(str(tmp_path / "v2"), b"version 2!"), "transcripts/x/chunks.json")
+    assert open(cache.local_path("transcripts/x/chunks.json"), "rb").read() == b"version 2!"
+    assert cache.cache_stats()["used_bytes"] == 10
+
+
+def test_cache_limit_is_shared_between_processes(s3, tmp_path):
+    # two CachedStorage instances on one directory stand for two worker processes
+    for name in "abcd":
+        s3.upload_file(write(str(tmp_path / name), name.encode() * 400), f"hls/x/{name}.ts")
+    worker_1 = CachedStorage(s3, str(tmp_path / "cache"), max_bytes=1000)
+    worker_2 = CachedStorage(s3, str(tmp_path / "cache"), max_bytes=1000)
+
+    worker_1.local_path("hls/x/a.ts")
+    time.sleep(0.01)
+    worker_2.local_path("hls/x/b.ts")
+    time.sleep(0.01)
+    worker_1.local_path("hls/x/a.ts")       # a is now more recently used than b
+    time.sleep(0.01)
+    worker_2.local_path("hls/x/c.ts")
+
+    cached = sorted(name for name in os.listdir(tmp_path / "cache" / "hls" / "x"))
+    assert cached == ["a.ts", "c.ts"]
+    assert worker_1.cache_stats()["used_bytes"] == 800
+    assert worker_1.local_path("hls/x/b.ts")    # evicted by the other worker: downloaded again
+
+
+def test_eviction_frees_down_to_the_low_water_mark(s3, tmp_path, monkeypatch):
+    for number in range(12):
+        s3.upload_file(write(str(tmp_path / str(number)), b"x" * 100), f"hls/x/{number}.ts")
+    cache = CachedStorage(s3, str(tmp_path / "cache"), max_bytes=1000, low_water=0.8)
+    scans = []
+    scan_and_evict = cache._scan_and_evict
+    monkeypatch.setattr(cache, "_scan_and_evict", lambda *args, **kwargs: scans.append(1) or scan_and_evict(*args, **kwargs))
+
+    for number in range(11):
+        cache.local_path(f"hls/x/{number}.ts")
+        time.sleep(0.01)
+    assert len(scans) == 1 and cache.cache_stats()["used_bytes"] == 800
+
+    cache.local_path("hls/x/11.ts")      # fits again without scanning the directory
+    assert len(scans) == 1 and cache.cache_stats()["used_bytes"] == 900
+    assert not os.path.exists(tmp_path / "cache" / "hls" / "x" / "0.ts")
@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from backend.services.warmup import IMPORT_TIME_BUDGET_S, import_in_fresh_interpreter, measure_import_time
+
+
+def test_app_import_defers_heavy_packages():
+    _, loaded = import_in_fresh_interpreter("backend.main")
+    assert loaded == []
+
+
+def test_app_import_stays_within_budget():
+    # fastest of a few runs, so a busy machine doesn't fail the test on one slow start
+    assert measure_import_time("backend.main") <= IMPORT_TIME_BUDGET_S
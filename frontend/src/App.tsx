@@ -1,5 +1,6 @@
 // File: frontend/src/App.tsx
 import { useState, useRef, useEffect } from 'react'
+import Hls from 'hls.js'
 import './App.css'
 
 interface Box {
@@ -14,6 +15,21 @@ interface LayoutData {
   }
 }
 
+// one id per browser tab: the backend queues the OpenAI calls of each session separately, and a new
+// explanation request of this tab replaces its own pending one (never another student's)
+const SESSION_ID_KEY = "sessionId"
+
+function getSessionId(): string {
+  let sessionId = sessionStorage.getItem(SESSION_ID_KEY)
+  if (!sessionId) {
+    sessionId = typeof crypto !== "undefined" && "randomUUID" in crypto
+      ? crypto.randomUUID()
+      : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+    sessionStorage.setItem(SESSION_ID_KEY, sessionId)
+  }
+  return sessionId
+}
+
 interface FetchedExplanations {
   [frameIndex: number]: {
     [box_id: number]: string; // or whatever type explanation is
@@ -63,6 +79,45 @@ function App() {
   }, [videoName])
 
 
+  // adaptive streaming from the HLS renditions (/hls/<video>/master.m3u8): hls.js where Media Source
+  // Extensions exist, native HLS (Safari) otherwise; the mp4 while the renditions are not published yet
+  useEffect(() => {
+    const video = videoRef.current
+    if (!video) return
+
+    const source = `/hls/${videoName}/master.m3u8`
+    if (!Hls.isSupported()) {
+      video.src = video.canPlayType('application/vnd.apple.mpegurl') ? source : `/video/${videoName}`
+      return
+    }
+
+    const hls = new Hls()
+    let reloads = 0
+    hls.on(Hls.Events.ERROR, (_event, data) => {
+      if (!data.fatal) return
+      if (data.details === Hls.ErrorDetails.MANIFEST_LOAD_ERROR) {
+        hls.destroy()
+        video.src = `/video/${videoName}`
+      } else if (data.type === Hls.ErrorTypes.MEDIA_ERROR) {
+        hls.recoverMediaError()
+      } else if (reloads < 3) {
+        // segments of a playlist loaded before the lecture was transcoded again are removed after a
+        // while: load the current playlists and continue at the same position
+        reloads += 1
+        hls.config.startPosition = video.currentTime
+        hls.loadSource(source)
+      } else {
+        hls.destroy()
+        video.src = `/video/${videoName}`
+      }
+    })
+    hls.loadSource(source)
+    hls.attachMedia(video)
+
+    return () => hls.destroy()
+  }, [videoName])
+
+
   useEffect(() => {
     console.log("layoutData updated:", layoutData)
   }, [layoutData])
@@ -143,7 +198,8 @@ function App() {
     const explainResponse = await fetch(`/explain`, {
       method: "POST",
       headers: { 
-        "Content-Type": "application/json" 
+        "Content-Type": "application/json",
+        "X-Session-Id": getSessionId()
       },
       body: JSON.stringify({ 
         video_name: videoName, 
@@ -226,9 +282,7 @@ function App() {
             setHoveredBoxId(null)
           }}
           style={{ display: 'block' }}
-        >
-          <source src={`/video/${videoName}`} type="video/mp4" />
-        </video>
+        />
 
         {layoutData && (
           <div className="layout-overlay">